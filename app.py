@@ -1,17 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
+from serializer import FastJSONProvider, loads, dumps
 import os
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'iot-secret')
 CORS(app)
 
-from auth import hash_password, verify_password, create_token, require_auth, require_role
+from auth import hash_password, verify_password, create_token, require_auth, require_role, HashPoolBusy, get_hash_stats, token_cache
 from models import *
 from mqtt_handler import init_mqtt, publish_control, get_mqtt_status
+from ingest import pipeline
+from control import dispatcher
+import presence
+import retention
+from config import HISTORY_MAX_BUCKETS, HISTORY_MAX_LIMIT, HISTORY_LTTB_OVERSAMPLE
+from timeseries import parse_time, epoch, bucket_width, lttb, device_ts
+from events import hub
+from respcache import cached, response_cache
+import metrics
+from config import STREAM_MAX_CLIENTS, STREAM_KEEPALIVE, STREAM_MIN_INTERVAL, BATCH_MAX_ITEMS, BATCH_MAX_FUTURE, EMAIL_WORKERS, MQTT_INGEST, METRICS_TOKEN
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import csv
+import io
+import datetime
+import time
 
 init_db()
-init_mqtt()
+hub.listen(presence.observe)
+presence.presence.start()
+init_mqtt(ingest=MQTT_INGEST)
+retention.start_compaction()
+mail_executor = ThreadPoolExecutor(EMAIL_WORKERS, thread_name_prefix='mail')
+
+STATS = {"db_pool": get_db_stats, "ingest": pipeline.stats, "slot_cache": get_slot_cache_stats,
+         "last_values": get_last_value_stats, "compaction": lambda: retention.stats, "stream": hub.stats,
+         "bcrypt": get_hash_stats, "tokens": token_cache.stats, "revocations": get_revocation_stats,
+         "response_cache": response_cache.stats, "control": dispatcher.stats, "presence": presence.presence.stats,
+         "spool": pipeline.spool_stats, "sqlite": get_sqlite_stats,
+         "partitions": get_partition_stats}
+for name, fn in STATS.items():
+    metrics.collect(name, fn)
+
+@app.before_request
+def start_timer():
+    request.started = time.perf_counter()
+    metrics.profiler.begin(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def record_timing(resp):
+    # route template, not path, keeps label cardinality bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.http_requests.observe(time.perf_counter() - request.started, request.method, route, resp.status_code)
+    return resp
+
+@app.teardown_request
+def end_profile(exc):
+    metrics.profiler.end()
+
+@app.errorhandler(HashPoolBusy)
+def hash_pool_busy(e):
+    return jsonify({"success": False, "error": "Máy chủ bận, thử lại sau"}), 503, {"Retry-After": "1"}
 
 # ===== HEALTH =====
 @app.route('/')
@@ -51,19 +102,24 @@ def api_forgot_password():
     code, err = create_reset_code(email)
     if err: return jsonify({"success": False, "error": err}), 400
     
+    if os.environ.get("RESEND_API_KEY"):
+        # the Resend call can take seconds; don't hold the worker for it
+        mail_executor.submit(send_reset_email, email, code)
+        return jsonify({"success": True, "message": "Đã gửi mã qua email!"}), 200
+    return jsonify({"success": True, "message": "Mã xác nhận!", "code": code}), 200
+
+def send_reset_email(email, code):
     try:
         import resend
         resend.api_key = os.environ.get("RESEND_API_KEY")
-        if resend.api_key:
-            resend.Emails.send({
-                "from": os.environ.get("EMAIL_FROM", "onboarding@resend.dev"),
-                "to": email,
-                "subject": "🔑 Mã reset - IoT",
-                "html": f"<h2>Mã xác nhận: <b>{code}</b></h2><p>Hết hạn sau 15 phút</p>"
-            })
-            return jsonify({"success": True, "message": "Đã gửi mã qua email!"}), 200
-    except: pass
-    return jsonify({"success": True, "message": "Mã xác nhận!", "code": code}), 200
+        resend.Emails.send({
+            "from": os.environ.get("EMAIL_FROM", "onboarding@resend.dev"),
+            "to": email,
+            "subject": "🔑 Mã reset - IoT",
+            "html": f"<h2>Mã xác nhận: <b>{code}</b></h2><p>Hết hạn sau 15 phút</p>"
+        })
+    except Exception as e:
+        print(f"Email Error: {e}")
 
 @app.route('/api/auth/reset-password', methods=['POST'])
 def api_reset_password():
@@ -102,10 +158,20 @@ def api_change_password():
     return jsonify({"success": True, "message": "Đổi mật khẩu thành công!"}), 200
 
 # ===== SLOTS =====
+def mqtt_connected():
+    return get_mqtt_status()['connected']
+
+def presence_version():
+    return presence.presence.version
+
+def with_presence(slots):
+    return [dict(s, presence=presence.presence.get(s['slot_number'])) for s in slots]
+
 @app.route('/api/slots', methods=['GET'])
 @require_auth
+@cached(get_slots_version, presence_version)
 def api_get_slots():
-    return jsonify({"success": True, "data": get_all_slots()}), 200
+    return jsonify({"success": True, "data": with_presence(get_all_slots())}), 200
 
 @app.route('/api/slots/available', methods=['GET'])
 @require_auth
@@ -118,7 +184,7 @@ def api_available_slots():
 def api_get_slot(num):
     s = get_slot_by_number(num)
     if not s: return jsonify({"success": False, "error": "Không tồn tại"}), 404
-    return jsonify({"success": True, "data": s}), 200
+    return jsonify({"success": True, "data": dict(s, presence=presence.presence.detail(num))}), 200
 
 @app.route('/api/slots', methods=['POST'])
 @require_auth
@@ -127,7 +193,7 @@ def api_create_slot():
     d = request.json
     num, name, stype = d.get('slot_number'), d.get('name','').strip(), d.get('type','value')
     if not num or not name: return jsonify({"success": False, "error": "Thiếu thông tin"}), 400
-    sid, err = create_slot(num, name, stype, d.get('icon','📟'), d.get('unit',''), d.get('location',''), d.get('stream_url',''))
+    sid, err = create_slot(num, name, stype, d.get('icon','📟'), d.get('unit',''), d.get('location',''), d.get('stream_url',''), d.get('retention_days'))
     if err: return jsonify({"success": False, "error": err}), 400
     return jsonify({"success": True, "message": f"Tạo Slot {num} thành công"}), 201
 
@@ -136,7 +202,8 @@ def api_create_slot():
 @require_role(['admin'])
 def api_update_slot(num):
     d = request.json
-    ok, err = update_slot(num, d.get('name'), d.get('type'), d.get('icon'), d.get('unit'), d.get('location'), d.get('stream_url'))
+    ok, err = update_slot(num, d.get('name'), d.get('type'), d.get('icon'), d.get('unit'), d.get('location'), d.get('stream_url'), d.get('retention_days'),
+                          reset_retention='retention_days' in d and d['retention_days'] is None)
     if err: return jsonify({"success": False, "error": err}), 400
     return jsonify({"success": True}), 200
 
@@ -150,6 +217,7 @@ def api_delete_slot(num):
 # ===== DATA =====
 @app.route('/api/data', methods=['GET'])
 @require_auth
+@cached(get_slots_version, get_data_version)
 def api_get_data():
     return jsonify({"success": True, "data": get_all_latest_data()}), 200
 
@@ -161,18 +229,128 @@ def api_get_slot_data(num):
 @app.route('/api/data/<int:num>/history', methods=['GET'])
 @require_auth
 def api_slot_history(num):
-    limit = request.args.get('limit', 100, type=int)
-    return jsonify({"success": True, "data": get_slot_history(num, limit)}), 200
+    a = request.args
+    limit = a.get('limit', 100, type=int)
+    try:
+        end = parse_time(a.get('to'), datetime.datetime.utcnow())
+        start = parse_time(a.get('from'))
+    except ValueError:
+        return jsonify({"success": False, "error": "Thời gian không hợp lệ"}), 400
+    bucket, points = a.get('bucket', type=int), a.get('points', type=int)
+    # LIMIT -1 is unbounded on SQLite; points < 3 would skip LTTB and return raw samples
+    if limit < 1 or (bucket is not None and bucket < 1) or (points is not None and points < 3):
+        return jsonify({"success": False, "error": "Tham số không hợp lệ"}), 400
+    limit = min(limit, HISTORY_MAX_LIMIT)
+    if start is None:
+        if bucket or points: return jsonify({"success": False, "error": "Thiếu from"}), 400
+        return jsonify({"success": True, "data": get_slot_history(num, limit)}), 200
+    if start >= end: return jsonify({"success": False, "error": "from phải trước to"}), 400
+    if points:
+        # LTTB over fine-grained bucket averages keeps the input to the downsampler bounded too
+        points = min(points, HISTORY_MAX_BUCKETS)
+        width = bucket_width(start, end, bucket, points * HISTORY_LTTB_OVERSAMPLE)
+        rows = get_slot_history_buckets(num, start, end, width)
+        data = [{"t": t, "value": v} for t, v in lttb([(r['t'], r['avg']) for r in rows], points)]
+        return jsonify({"success": True, "bucket": width, "data": data}), 200
+    if bucket:
+        width = bucket_width(start, end, bucket, HISTORY_MAX_BUCKETS)
+        return jsonify({"success": True, "bucket": width, "data": get_slot_history_buckets(num, start, end, width)}), 200
+    return jsonify({"success": True, "data": get_slot_history(num, limit, start, end)}), 200
+
+def export_chunks(rows_iter, fmt):
+    if fmt == 'csv':
+        yield "slot,ts,time,value\r\n"
+    for rows in rows_iter:
+        if fmt == 'csv':
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            for r in rows:
+                w.writerow((r['slot_number'], r['ts'],
+                            datetime.datetime.utcfromtimestamp(r['ts'] / 1000).isoformat(timespec='milliseconds') + 'Z', r['value']))
+            yield buf.getvalue()
+        else:
+            yield b''.join(dumps({"slot": r['slot_number'], "ts": r['ts'], "value": r['value']}) + b'\n' for r in rows)
+
+@app.route('/api/export', methods=['GET'])
+@require_auth
+def api_export():
+    # Streams slot_data for ?slots=1,2&from=..&to=.. as CSV or NDJSON, one keyset page at a time
+    a = request.args
+    fmt = a.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'): return jsonify({"success": False, "error": "format: csv/ndjson"}), 400
+    try:
+        end = parse_time(a.get('to'), datetime.datetime.utcnow())
+        start = parse_time(a.get('from'))
+    except ValueError:
+        return jsonify({"success": False, "error": "Thời gian không hợp lệ"}), 400
+    if start is None: return jsonify({"success": False, "error": "Thiếu from"}), 400
+    if start >= end: return jsonify({"success": False, "error": "from phải trước to"}), 400
+    try:
+        nums = [int(x) for x in a['slots'].split(',') if x] if a.get('slots') else [s['slot_number'] for s in get_all_slots()]
+    except ValueError:
+        return jsonify({"success": False, "error": "slots không hợp lệ"}), 400
+    known = slot_registry.numbers()
+    bad = [n for n in nums if n not in known]
+    if bad: return jsonify({"success": False, "error": f"Slot {bad[0]} chưa cấu hình"}), 404
+    name = f"slots-{epoch(start)}-{epoch(end)}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(export_chunks(iter_slot_history(nums, start, end), fmt), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{name}"', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/data', methods=['POST'])
 def api_post_data():
     d = request.json
     num, val = d.get('slot'), d.get('value')
     if num is None or val is None: return jsonify({"success": False, "error": "Thiếu"}), 400
-    if not get_slot_by_number(num): return jsonify({"success": False, "error": f"Slot {num} chưa cấu hình"}), 404
-    save_slot_data(num, val)
+    slot = get_slot_by_number(num)
+    if not slot: return jsonify({"success": False, "error": f"Slot {num} chưa cấu hình"}), 404
+    save_slot_data(slot['slot_number'], val)
     return jsonify({"success": True}), 201
 
+# Binary batch record: slot u16, ts i64 (epoch ms, 0 = now), value f64, little-endian
+BATCH_RECORD = struct.Struct('<Hqd')
+
+def parse_batch():
+    body = request.get_data()
+    if request.mimetype == 'application/octet-stream':
+        if len(body) % BATCH_RECORD.size: raise ValueError("độ dài không hợp lệ")
+        return [{'slot': s, 'ts': t or None, 'value': v} for s, t, v in BATCH_RECORD.iter_unpack(body)]
+    if request.mimetype == 'application/x-ndjson':
+        return [loads(line) for line in body.splitlines() if line.strip()]
+    d = loads(body)
+    return d.get('items') if isinstance(d, dict) else d
+
+@app.route('/api/data/batch', methods=['POST'])
+def api_post_data_batch():
+    # For devices flushing offline buffers: one registry check, one transaction, per-item results
+    try:
+        items = parse_batch()
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Dữ liệu không hợp lệ: {e}"}), 400
+    if not isinstance(items, list): return jsonify({"success": False, "error": "Cần một mảng"}), 400
+    if len(items) > BATCH_MAX_ITEMS: return jsonify({"success": False, "error": f"Tối đa {BATCH_MAX_ITEMS}"}), 413
+    known = slot_registry.numbers()
+    now = int(time.time() * 1000)
+    horizon = now + int(BATCH_MAX_FUTURE * 1000)
+    rows, results = [], []
+    for it in items:
+        err = None
+        if not isinstance(it, dict) or it.get('value') is None:
+            err = "Thiếu slot/value"
+        else:
+            try: num = int(it.get('slot'))
+            except (TypeError, ValueError): num = None
+            try: ts = device_ts(it.get('ts'), horizon) or now
+            except ValueError as e: err = str(e)
+            if num not in known: err = f"Slot {it.get('slot')} chưa cấu hình"
+        if err:
+            results.append({"ok": False, "error": err})
+        else:
+            rows.append((num, it['value'], ts))
+            results.append({"ok": True})
+    save_slot_data_many(rows)
+    return jsonify({"success": True, "accepted": len(rows), "rejected": len(items) - len(rows), "results": results}), 201
+
 # ===== CONTROL =====
 @app.route('/api/control/<int:num>', methods=['POST'])
 @require_auth
@@ -183,9 +361,36 @@ def api_control(num):
     if cmd not in [0, 1]: return jsonify({"success": False, "error": "Command 0/1"}), 400
     slot = get_slot_by_number(num)
     if not slot or slot['type'] != 'control': return jsonify({"success": False, "error": "Slot không hợp lệ"}), 400
-    publish_control(num, cmd)
-    save_slot_data(num, cmd)
-    return jsonify({"success": True, "message": f"{'BẬT' if cmd else 'TẮT'} Slot {num}"}), 200
+    # The value is recorded when the device acks on iot/status, not here
+    seqs = publish_control([(num, cmd)])
+    if seqs is None: return jsonify({"success": False, "error": "MQTT chưa cấu hình"}), 503
+    return jsonify({"success": True, "message": f"{'BẬT' if cmd else 'TẮT'} Slot {num}", "seq": seqs[0]}), 202
+
+@app.route('/api/control', methods=['POST'])
+@require_auth
+@require_role(['admin', 'operator'])
+def api_control_group():
+    # {"slots": [1, 2], "command": 1} or {"commands": [{"slot": 1, "command": 0}, ...]}
+    d = request.json or {}
+    items = d.get('commands')
+    if items is None: items = [{"slot": n, "command": d.get('command')} for n in d.get('slots') or []]
+    if not isinstance(items, list) or not items: return jsonify({"success": False, "error": "Thiếu lệnh"}), 400
+    commands, results = [], []
+    for it in items:
+        slot = get_slot_by_number(it.get('slot')) if isinstance(it, dict) else None
+        if not slot or slot['type'] != 'control':
+            results.append({"ok": False, "error": "Slot không hợp lệ"})
+        elif it.get('command') not in [0, 1]:
+            results.append({"ok": False, "error": "Command 0/1"})
+        else:
+            commands.append((slot['slot_number'], it['command']))
+            results.append({"ok": True})
+    seqs = publish_control(commands) if commands else []
+    if seqs is None: return jsonify({"success": False, "error": "MQTT chưa cấu hình"}), 503
+    it = iter(seqs)
+    for r in results:
+        if r['ok']: r['seq'] = next(it)
+    return jsonify({"success": True, "accepted": len(commands), "rejected": len(items) - len(commands), "results": results}), 202
 
 # ===== CAMERA =====
 @app.route('/api/camera/<int:num>', methods=['GET'])
@@ -193,34 +398,95 @@ def api_control(num):
 def api_get_camera(num):
     slot = get_slot_by_number(num)
     if not slot or slot['type'] != 'camera': return jsonify({"success": False, "error": "Không hợp lệ"}), 400
-    img = get_camera_image(num)
-    return jsonify({"success": True, "data": {
-        "image_data": img['image_data'] if img else None,
-        "stream_url": slot.get('stream_url',''),
-        "created_at": img['created_at'] if img else None
-    }}), 200
+    frame = get_camera_image(num, request.args.get('seq', type=int))
+    if not frame or not os.path.exists(camera_frame_path(frame['digest'])):
+        return jsonify({"success": False, "error": "Chưa có ảnh"}), 404
+    # Raw bytes; the content digest is a strong ETag so pollers get 304 until the frame changes
+    rv = send_file(camera_frame_path(frame['digest']), mimetype=frame['content_type'], etag=frame['digest'],
+                   last_modified=frame['ts'] / 1000, conditional=True)
+    rv.cache_control.no_cache = True
+    rv.cache_control.private = True
+    return rv
+
+@app.route('/api/camera/<int:num>/info', methods=['GET'])
+@require_auth
+def api_get_camera_info(num):
+    slot = get_slot_by_number(num)
+    if not slot or slot['type'] != 'camera': return jsonify({"success": False, "error": "Không hợp lệ"}), 400
+    return jsonify({"success": True, "data": {"stream_url": slot.get('stream_url',''), "frames": get_camera_frames(num)}}), 200
 
 @app.route('/api/camera/<int:num>', methods=['POST'])
 def api_post_camera(num):
-    d = request.json
-    img = d.get('image')
+    if request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream':
+        img = request.get_data()
+    else:
+        img = (request.get_json(silent=True) or {}).get('image')
     if not img: return jsonify({"success": False, "error": "Thiếu image"}), 400
     slot = get_slot_by_number(num)
     if not slot or slot['type'] != 'camera': return jsonify({"success": False, "error": "Không hợp lệ"}), 404
-    save_camera_image(num, img)
+    try:
+        save_camera_image(num, img)
+    except ValueError:
+        return jsonify({"success": False, "error": "Ảnh không hợp lệ"}), 400
     return jsonify({"success": True}), 201
 
+# ===== STREAM =====
+def sse(evt):
+    return f"event: {evt['type']}\ndata: {dumps(evt).decode()}\n\n"
+
+@app.route('/api/stream', methods=['GET'])
+@require_auth
+def api_stream():
+    # Server-Sent Events: data / camera / mqtt. Needs an async worker class (see Procfile).
+    slots = request.args.get('slots')
+    try:
+        slots = set(int(x) for x in slots.split(',') if x) if slots else None
+    except ValueError:
+        return jsonify({"success": False, "error": "slots không hợp lệ"}), 400
+    if hub.stats()['subscribers'] >= STREAM_MAX_CLIENTS:
+        return jsonify({"success": False, "error": "Quá nhiều kết nối"}), 503
+    sub = hub.subscribe(slots)
+    def gen():
+        try:
+            yield "retry: 3000\n\n"
+            yield sse(dict(get_mqtt_status(), type='mqtt'))
+            for num, r in get_all_latest_data().items():
+                if slots is None or num in slots:
+                    yield sse({'type': 'data', 'slot': num, 'value': r['value'], 'ts': r['ts']})
+            while True:
+                evts = sub.drain(STREAM_KEEPALIVE)
+                if not evts:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(sse(e) for e in evts)
+                # let fast slots coalesce before the next write
+                time.sleep(STREAM_MIN_INTERVAL)
+        finally:
+            hub.unsubscribe(sub)
+    return Response(gen(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/presence', methods=['GET'])
+@require_auth
+def api_presence():
+    return jsonify({"success": True, "data": presence.presence.all()}), 200
+
 # ===== DASHBOARD =====
 @app.route('/api/dashboard/stats', methods=['GET'])
 @require_auth
+@cached(get_slots_version, presence_version)
 def api_stats():
-    return jsonify({"success": True, "data": get_dashboard_stats()}), 200
+    stats = get_dashboard_stats()
+    stats['online_devices'] = sum(1 for s in get_all_slots() if presence.presence.get(s['slot_number'])['online'])
+    return jsonify({"success": True, "data": stats}), 200
 
 @app.route('/api/dashboard/full', methods=['GET'])
 @require_auth
+@cached(get_slots_version, get_data_version, mqtt_connected, presence_version)
 def api_full_dashboard():
-    return jsonify({"success": True, "stats": get_dashboard_stats(), "slots": get_all_slots(), 
-                    "data": get_all_latest_data(), "mqtt": get_mqtt_status()}), 200
+    stats, slots, data = get_dashboard_snapshot()
+    slots = with_presence(slots)
+    stats['online_devices'] = sum(1 for s in slots if s['presence']['online'])
+    return jsonify({"success": True, "stats": stats, "slots": slots, "data": data, "mqtt": get_mqtt_status()}), 200
 
 # ===== ADMIN =====
 @app.route('/api/admin/users', methods=['GET'])
@@ -256,6 +522,29 @@ def api_delete_user(uid):
     delete_user(uid)
     return jsonify({"success": True}), 200
 
+@app.route('/api/admin/metrics', methods=['GET'])
+@require_auth
+@require_role(['admin'])
+def api_admin_metrics():
+    return jsonify({"success": True, "data": {name: fn() for name, fn in STATS.items()}}), 200
+
+@app.route('/api/admin/profile', methods=['GET', 'DELETE'])
+@require_auth
+@require_role(['admin'])
+def api_admin_profile():
+    # Stack samples of requests slower than PROFILE_SLOW_MS, grouped by route
+    if not metrics.profiler.enabled: return jsonify({"success": False, "error": "PROFILE_SLOW_MS chưa bật"}), 400
+    if request.method == 'DELETE':
+        metrics.profiler.reset()
+        return jsonify({"success": True}), 200
+    return jsonify({"success": True, "data": metrics.profiler.report(request.args.get('top', 5, type=int))}), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({"success": False, "error": "Không có quyền"}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/mqtt/status', methods=['GET'])
 @require_auth
 def api_mqtt_status():
@@ -0,0 +1,162 @@
+# ASGI serving mode:  uvicorn asgi:application --workers 4
+# /api/stream runs natively on the event loop (no thread per client); every other route is the
+# unchanged Flask app run on a bounded thread pool, so slow Postgres, bcrypt or email calls
+# occupy a pool thread instead of a whole worker process.
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from config import ASGI_THREADS, STREAM_KEEPALIVE, STREAM_MIN_INTERVAL, STREAM_MAX_CLIENTS
+from app import app as flask_app, sse
+from auth import decode_token
+from events import hub
+from models import get_all_latest_data
+from mqtt_handler import get_mqtt_status
+from serializer import dumps
+
+executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix='wsgi')
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        'CONTENT_LENGTH': str(len(body)),
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1')
+        value = value.decode('latin1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+async def read_body(receive):
+    body = b''
+    while True:
+        msg = await receive()
+        body += msg.get('body', b'')
+        if not msg.get('more_body'):
+            return body
+
+async def send_json(send, status, data):
+    await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': dumps(data)})
+
+async def wsgi(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, await read_body(receive))
+    started = {}
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers]
+    def call():
+        result = flask_app(environ, start_response)
+        if any(k == b'content-length' for k, _ in started['headers']):
+            # sized response: finish it in this one pool hop
+            try:
+                return b''.join(result), None
+            finally:
+                if hasattr(result, 'close'): result.close()
+        return None, result
+    body, result = await loop.run_in_executor(executor, call)
+    await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+    if result is None:
+        await send({'type': 'http.response.body', 'body': body})
+        return
+    # streamed response (exports): pull each chunk on the pool
+    try:
+        it = iter(result)
+        while True:
+            chunk = await loop.run_in_executor(executor, next, it, None)
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(executor, result.close)
+
+async def stream(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    headers = dict(scope['headers'])
+    args = parse_qs(scope['query_string'].decode())
+    auth = headers.get(b'authorization', b'').decode('latin1')
+    token = auth[7:] if auth.startswith('Bearer ') else (args.get('token') or [None])[0]
+    if not token:
+        return await send_json(send, 401, {"success": False, "error": "Token không hợp lệ"})
+    if not await loop.run_in_executor(executor, decode_token, token):
+        return await send_json(send, 401, {"success": False, "error": "Token hết hạn"})
+    try:
+        slots = set(int(x) for x in args['slots'][0].split(',') if x) if 'slots' in args else None
+    except ValueError:
+        return await send_json(send, 400, {"success": False, "error": "slots không hợp lệ"})
+    if hub.stats()['subscribers'] >= STREAM_MAX_CLIENTS:
+        return await send_json(send, 503, {"success": False, "error": "Quá nhiều kết nối"})
+
+    wake = asyncio.Event()
+    sub = hub.subscribe(slots)
+    sub.waker = lambda: loop.call_soon_threadsafe(wake.set)
+    closed = asyncio.Event()
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        closed.set()
+        wake.set()
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]})
+        latest = await loop.run_in_executor(executor, get_all_latest_data)
+        out = ["retry: 3000\n\n", sse(dict(get_mqtt_status(), type='mqtt'))]
+        out += [sse({'type': 'data', 'slot': n, 'value': r['value'], 'ts': r['ts']}) for n, r in latest.items()
+                if slots is None or n in slots]
+        await send({'type': 'http.response.body', 'body': ''.join(out).encode(), 'more_body': True})
+        while not closed.is_set():
+            try:
+                await asyncio.wait_for(wake.wait(), STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                pass
+            wake.clear()
+            if closed.is_set():
+                break
+            evts = sub.take()
+            body = ''.join(sse(e) for e in evts) if evts else ": keepalive\n\n"
+            await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+            await asyncio.sleep(STREAM_MIN_INTERVAL)
+    finally:
+        hub.unsubscribe(sub)
+        watcher.cancel()
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            msg = await receive()
+            if msg['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif msg['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if scope['path'] == '/api/stream' and scope['method'] == 'GET':
+        return await stream(scope, receive, send)
+    return await wsgi(scope, receive, send)
@@ -1,32 +1,136 @@
 import jwt
 import bcrypt
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from flask import request, jsonify
-from config import SECRET_KEY
+from config import SECRET_KEY, BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_QUEUE, TOKEN_TTL_DAYS, TOKEN_CACHE_SIZE
+from models import token_revoked
+
+class HashPoolBusy(Exception):
+    pass
+
+# bcrypt releases the GIL, so a few threads give real parallelism; callers beyond
+# BCRYPT_WORKERS running + BCRYPT_QUEUE waiting are turned away instead of piling up.
+_hash_pool = None
+_hash_slots = threading.BoundedSemaphore(BCRYPT_WORKERS + BCRYPT_QUEUE)
+_hash_lock = threading.Lock()
+hash_stats = {'calls': 0, 'rejected': 0, 'in_flight': 0, 'time': 0.0, 'max_time': 0.0}
+
+def _pool():
+    global _hash_pool
+    if _hash_pool is None:
+        try:
+            from gevent import monkey
+            if monkey.is_module_patched('threading'):
+                # under gevent workers "threads" are greenlets; use real OS threads
+                # whose futures wait cooperatively
+                from gevent.threadpool import ThreadPoolExecutor as GeventExecutor
+                _hash_pool = GeventExecutor(BCRYPT_WORKERS)
+                return _hash_pool
+        except ImportError:
+            pass
+        _hash_pool = ThreadPoolExecutor(BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+    return _hash_pool
+
+def _run_hash(fn, *args):
+    if not _hash_slots.acquire(blocking=False):
+        with _hash_lock: hash_stats['rejected'] += 1
+        raise HashPoolBusy()
+    start = time.perf_counter()
+    with _hash_lock: hash_stats['in_flight'] += 1
+    try:
+        return _pool().submit(fn, *args).result()
+    finally:
+        _hash_slots.release()
+        took = time.perf_counter() - start
+        with _hash_lock:
+            hash_stats['in_flight'] -= 1
+            hash_stats['calls'] += 1
+            hash_stats['time'] += took
+            hash_stats['max_time'] = max(hash_stats['max_time'], took)
+
+def get_hash_stats():
+    with _hash_lock:
+        s = dict(hash_stats)
+    s.update({'workers': BCRYPT_WORKERS, 'queue': BCRYPT_QUEUE, 'rounds': BCRYPT_ROUNDS,
+              'avg_time': s['time'] / s['calls'] if s['calls'] else 0.0})
+    return s
 
 def hash_password(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return _run_hash(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(BCRYPT_ROUNDS)).decode('utf-8'))
 
 def verify_password(password, password_hash):
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    return _run_hash(lambda: bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')))
+
+class TokenCache:
+    # Verified payloads keyed by token digest, so hot tokens skip the HMAC check
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._stats['misses'] += 1
+                return None
+            if item.get('exp') is not None and item['exp'] <= time.time():
+                del self._items[key]
+                self._stats['expired'] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats['hits'] += 1
+            return item
+
+    def put(self, key, payload):
+        with self._lock:
+            self._items[key] = payload
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['size'] = len(self._items)
+        return s
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
 
 def create_token(user_id, email, role):
     import datetime
+    now = datetime.datetime.utcnow()
     payload = {
         'user_id': user_id,
         'email': email,
         'role': role,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7)
+        'iat': now,
+        # iat is whole seconds; revocations compare this, so a token minted earlier in the revoking
+        # second is rejected while a re-login right after it is not
+        'iat_ms': int(time.time() * 1000),
+        'exp': now + datetime.timedelta(days=TOKEN_TTL_DAYS)
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
 def decode_token(token):
-    try:
-        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            return None
+        token_cache.put(key, payload)
+    if token_revoked(payload):
         return None
+    return payload
 
 def require_auth(f):
     @wraps(f)
@@ -36,6 +140,9 @@ def require_auth(f):
             auth_header = request.headers['Authorization']
             if auth_header.startswith('Bearer '):
                 token = auth_header.split(' ')[1]
+        elif request.path == '/api/stream':
+            # EventSource can't send headers
+            token = request.args.get('token')
         
         if not token:
             return jsonify({'success': False, 'error': 'Token không hợp lệ'}), 401
@@ -0,0 +1,89 @@
+# MQTT ingestion throughput vs number of worker.py instances.
+#   mosquitto -p 1883 &
+#   python bench/ingest_scale.py --broker localhost --port 1883 --instances 1,2,4 --messages 50000 --out ingest.json
+# Workers share one database (DATABASE_URL if set, else SQLite in a temp dir) and a
+# fresh MQTT v5 share group; a run ends when every published sample is in slot_data.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOT = 1
+
+def start_workers(n, a, cwd, group):
+    env = dict(os.environ, PYTHONPATH=ROOT, MQTT_BROKER=a.broker, MQTT_PORT=str(a.port), MQTT_TLS='0',
+               MQTT_USERNAME='', MQTT_PASSWORD='', MQTT_SHARE_GROUP=group)
+    return [subprocess.Popen([sys.executable, os.path.join(ROOT, 'worker.py')], cwd=cwd, env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) for _ in range(n)]
+
+def publish(a, count):
+    import paho.mqtt.client as mqtt
+    c = mqtt.Client(client_id=f'bench-pub-{os.getpid()}', protocol=mqtt.MQTTv5)
+    c.connect(a.broker, a.port, 60)
+    c.loop_start()
+    start = time.monotonic()
+    info = None
+    for i in range(count):
+        info = c.publish('iot/data', json.dumps({'slot': SLOT, 'value': i}), qos=1)
+    info.wait_for_publish()
+    took = time.monotonic() - start
+    c.loop_stop()
+    c.disconnect()
+    return start, took
+
+def run(models, a, n, cwd):
+    models.delete_slot(SLOT)
+    models.create_slot(SLOT, 'bench', 'chart')
+    procs = start_workers(n, a, cwd, f'bench-{os.getpid()}-{n}')
+    try:
+        time.sleep(a.warmup)
+        start, pub = publish(a, a.messages)
+        count = 0
+        deadline = time.monotonic() + a.timeout
+        while time.monotonic() < deadline:
+            count = models.q("SELECT COUNT(*) AS n FROM slot_data WHERE slot_number = ?", (SLOT,), one=True)['n']
+            if count >= a.messages: break
+            time.sleep(0.05)
+        elapsed = time.monotonic() - start
+    finally:
+        for p in procs: p.terminate()
+        for p in procs: p.wait()
+    return {'instances': n, 'messages': a.messages, 'stored': count, 'publish_s': pub,
+            'elapsed_s': elapsed, 'samples_per_s': count / elapsed}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--broker', default='localhost')
+    ap.add_argument('--port', type=int, default=1883)
+    ap.add_argument('--instances', default='1,2,4')
+    ap.add_argument('--messages', type=int, default=50000)
+    ap.add_argument('--warmup', type=float, default=2)
+    ap.add_argument('--timeout', type=float, default=120)
+    ap.add_argument('--out')
+    a = ap.parse_args()
+    out = os.path.abspath(a.out) if a.out else None
+    cwd = tempfile.mkdtemp(prefix='bench-ingest-')
+    os.chdir(cwd)
+    sys.path.insert(0, ROOT)
+    import models
+    models.init_db()
+    results = []
+    try:
+        for n in [int(x) for x in a.instances.split(',')]:
+            r = run(models, a, n, cwd)
+            print(json.dumps(r))
+            results.append(r)
+    finally:
+        models.delete_slot(SLOT)
+        shutil.rmtree(cwd, ignore_errors=True)
+    if out:
+        with open(out, 'w') as f:
+            json.dump({'benchmark': 'ingest_scale', 'time': time.time(), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# JSON backends and row conversion on the payloads this service actually moves.
+#   python bench/serializer.py --number 2000 --out serializer.json
+# Compares the stdlib and orjson (if installed) for decode/encode, and per-row vs
+# per-cursor column lists when turning DB tuples into dicts.
+import argparse
+import json
+import os
+import sys
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from flask.json.provider import _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DESCRIPTION = [('id',), ('slot_number',), ('value',), ('ts',)]
+
+def history(n):
+    now = int(time.time() * 1000)
+    return [(i, 3, 20.0 + (i % 50) / 10, now - i * 1000) for i in range(n)]
+
+def payloads():
+    slots = [{'slot_number': n, 'name': f'Cảm biến {n}', 'type': 'chart', 'icon': '📟', 'unit': '°C',
+              'location': 'Phòng khách', 'is_active': 1, 'presence': {'online': True, 'since': 1700000000000}}
+             for n in range(1, 21)]
+    latest = {n: {'slot_number': n, 'value': 21.5 + n, 'ts': 1700000000000 + n} for n in range(1, 21)}
+    return {
+        'mqtt_sample': {'slot': 3, 'value': 23.7, 'ts': 1700000000},
+        'dashboard_full': {'success': True, 'stats': {'total_slots': 20}, 'slots': slots, 'data': latest,
+                           'mqtt': {'connected': True, 'broker': 'broker.local'}},
+        'history_1k': {'success': True, 'data': [dict(zip(('id', 'slot_number', 'value', 'ts'), r)) for r in history(1000)]},
+        'history_10k': {'success': True, 'data': [dict(zip(('id', 'slot_number', 'value', 'ts'), r)) for r in history(10000)]},
+    }
+
+def backends():
+    out = {'json': (lambda b: json.loads(b),
+                    lambda o: json.dumps(o, default=_default, sort_keys=True, separators=(',', ':')).encode())}
+    if orjson:
+        opts = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        out['orjson'] = (orjson.loads, lambda o: orjson.dumps(o, default=_default, option=opts))
+    return out
+
+def per_us(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1e6
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--number', type=int, default=2000)
+    ap.add_argument('--out')
+    a = ap.parse_args()
+    results = []
+    for name, obj in payloads().items():
+        raw = json.dumps(obj).encode()
+        # big payloads get fewer iterations so every case takes a similar time
+        n = max(a.number * 200 // max(len(raw) // 100, 1), 10) if len(raw) > 20000 else a.number
+        for backend, (loads, dumps) in backends().items():
+            r = {'case': name, 'backend': backend, 'bytes': len(raw),
+                 'decode_us': per_us(lambda: loads(raw), n), 'encode_us': per_us(lambda: dumps(obj), n)}
+            print(json.dumps(r))
+            results.append(r)
+    rows = history(10000)
+    n = max(a.number // 100, 5)
+    for mode, fn in (('per_row', lambda: [dict(zip([c[0] for c in DESCRIPTION], r)) for r in rows]),
+                     ('per_cursor', lambda: (lambda cols: [dict(zip(cols, r)) for r in rows])([c[0] for c in DESCRIPTION]))):
+        r = {'case': 'rows_10k', 'backend': mode, 'convert_us': per_us(fn, n)}
+        print(json.dumps(r))
+        results.append(r)
+    if a.out:
+        with open(a.out, 'w') as f:
+            json.dump({'benchmark': 'serializer', 'time': time.time(), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+# Sync (gunicorn) vs ASGI (uvicorn) serving throughput.
+#   python bench/serving.py --modes sync,asgi --workers 2 --concurrency 64 --duration 10 --out serving.json
+# Each mode gets a fresh SQLite database in a temp dir and MQTT disabled; results are JSON.
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN = {'email': 'admin@admin.com', 'password': 'admin123'}
+SCENARIOS = {
+    'data': ('GET', '/api/data', None),
+    'dashboard': ('GET', '/api/dashboard/full', None),
+    'history': ('GET', '/api/data/1/history?limit=100', None),
+    'login': ('POST', '/api/auth/login', ADMIN),  # bcrypt-bound
+}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, workers, cwd):
+    env = dict(os.environ, MQTT_BROKER='', PYTHONPATH=ROOT, COMPACT_INTERVAL='0')
+    if mode == 'sync':
+        cmd = [sys.executable, '-m', 'gunicorn', '-k', 'sync', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app']
+    elif mode == 'gevent':
+        cmd = [sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:app']
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--port', str(port), '--log-level', 'warning', 'asgi:application']
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(200):
+        try:
+            request(port, 'GET', '/')
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+def request(port, method, path, body=None, token=None, conn=None):
+    c = conn or http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    headers = {'Content-Type': 'application/json'}
+    if token: headers['Authorization'] = 'Bearer ' + token
+    c.request(method, path, json.dumps(body) if body is not None else None, headers)
+    r = c.getresponse()
+    data = r.read()
+    if conn is None: c.close()
+    return r.status, data
+
+def seed(port, slots):
+    _, data = request(port, 'POST', '/api/auth/login', ADMIN)
+    token = json.loads(data)['token']
+    for n in range(1, slots + 1):
+        request(port, 'POST', '/api/slots', {'slot_number': n, 'name': f's{n}', 'type': 'chart'}, token)
+        request(port, 'POST', '/api/data', {'slot': n, 'value': n})
+    return token
+
+def load(port, scenario, token, concurrency, duration):
+    method, path, body = SCENARIOS[scenario]
+    lat, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    def worker():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        while time.monotonic() < deadline:
+            t = time.perf_counter()
+            try:
+                status, _ = request(port, method, path, body, token, conn)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            if ok: mine.append(time.perf_counter() - t)
+            else:
+                with lock: errors[0] += 1
+        with lock: lat.extend(mine)
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.monotonic()
+    for t in threads: t.start()
+    for t in threads: t.join()
+    elapsed = time.monotonic() - start
+    lat.sort()
+    pct = lambda p: lat[min(int(len(lat) * p), len(lat) - 1)] * 1000 if lat else None
+    return {'requests': len(lat), 'errors': errors[0], 'rps': len(lat) / elapsed,
+            'p50_ms': pct(0.50), 'p99_ms': pct(0.99)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--modes', default='sync,asgi')
+    ap.add_argument('--scenarios', default='data,dashboard,login')
+    ap.add_argument('--workers', type=int, default=2)
+    ap.add_argument('--concurrency', type=int, default=64)
+    ap.add_argument('--duration', type=float, default=10)
+    ap.add_argument('--slots', type=int, default=20)
+    ap.add_argument('--out')
+    a = ap.parse_args()
+    results = []
+    for mode in a.modes.split(','):
+        cwd = tempfile.mkdtemp(prefix=f'bench-{mode}-')
+        port = free_port()
+        proc = start_server(mode, port, a.workers, cwd)
+        try:
+            token = seed(port, a.slots)
+            for scenario in a.scenarios.split(','):
+                r = dict(mode=mode, scenario=scenario, workers=a.workers, concurrency=a.concurrency,
+                         **load(port, scenario, token, a.concurrency, a.duration))
+                print(json.dumps(r))
+                results.append(r)
+        finally:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(cwd, ignore_errors=True)
+    if a.out:
+        with open(a.out, 'w') as f:
+            json.dump({'benchmark': 'serving', 'time': time.time(), 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import hashlib
+import os
+import tempfile
+
+class BlobStore:
+    # Content-addressed files: <root>/<first 2 hex>/<sha256>. Identical frames share one file.
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def delete(self, digest):
+        try: os.remove(self.path(digest))
+        except FileNotFoundError: pass
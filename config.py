@@ -12,3 +12,105 @@ RESEND_API_KEY = os.environ.get('RESEND_API_KEY', '')
 EMAIL_FROM = os.environ.get('EMAIL_FROM', 'onboarding@resend.dev')
 
 MAX_SLOTS = 20
+
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+DB_POOL_IDLE_TIMEOUT = float(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', 10))
+
+INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 500))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 0.5))
+INGEST_PUT_TIMEOUT = float(os.environ.get('INGEST_PUT_TIMEOUT', 0))
+# Local write-ahead spool for DB outages; empty disables (failed batches are lost)
+SPOOL_DIR = os.environ.get('SPOOL_DIR', 'spool')
+SPOOL_SEGMENT_MB = int(os.environ.get('SPOOL_SEGMENT_MB', 16))
+SPOOL_MAX_MB = int(os.environ.get('SPOOL_MAX_MB', 512))
+SPOOL_REPLAY_BATCH = int(os.environ.get('SPOOL_REPLAY_BATCH', 5000))
+# After a failed write, spool without trying the DB for this many seconds
+SPOOL_RETRY_INTERVAL = float(os.environ.get('SPOOL_RETRY_INTERVAL', 5))
+# Replays refused this many times while the DB takes other writes drop the rows it won't store
+SPOOL_MAX_REPLAYS = int(os.environ.get('SPOOL_MAX_REPLAYS', 5))
+
+# SQLite only: WAL, per-thread read connections and a group-committing writer thread
+SQLITE_TUNED = os.environ.get('SQLITE_TUNED', '1') == '1'
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_MB = int(os.environ.get('SQLITE_CACHE_MB', 64))
+SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', 256))
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_GROUP_MAX = int(os.environ.get('SQLITE_GROUP_MAX', 256))
+
+SLOT_CACHE_CHECK_INTERVAL = float(os.environ.get('SLOT_CACHE_CHECK_INTERVAL', 2))
+LAST_VALUE_CACHE = os.environ.get('LAST_VALUE_CACHE', '1') == '1'
+
+HISTORY_MAX_BUCKETS = int(os.environ.get('HISTORY_MAX_BUCKETS', 1000))
+HISTORY_MAX_LIMIT = int(os.environ.get('HISTORY_MAX_LIMIT', 10000))
+HISTORY_LTTB_OVERSAMPLE = int(os.environ.get('HISTORY_LTTB_OVERSAMPLE', 8))
+MIGRATE_CHUNK = int(os.environ.get('MIGRATE_CHUNK', 50000))
+
+RAW_RETENTION_DAYS = int(os.environ.get('RAW_RETENTION_DAYS', 30))
+ROLLUP_1M_RETENTION_DAYS = int(os.environ.get('ROLLUP_1M_RETENTION_DAYS', 90))
+ROLLUP_1H_RETENTION_DAYS = int(os.environ.get('ROLLUP_1H_RETENTION_DAYS', 730))
+ROLLUP_1D_RETENTION_DAYS = int(os.environ.get('ROLLUP_1D_RETENTION_DAYS', 0))
+COMPACT_INTERVAL = float(os.environ.get('COMPACT_INTERVAL', 60))
+COMPACT_CHUNK = int(os.environ.get('COMPACT_CHUNK', 10000))
+COMPACT_MAX_CHUNKS = int(os.environ.get('COMPACT_MAX_CHUNKS', 50))
+# Postgres only: range-partition slot_data on ts, this many days per partition; 0 keeps one table.
+# Optionally hash sub-partition each range by slot_number into PG_PARTITION_SLOT_HASH parts.
+PG_PARTITION_DAYS = int(os.environ.get('PG_PARTITION_DAYS', 0))
+PG_PARTITION_SLOT_HASH = int(os.environ.get('PG_PARTITION_SLOT_HASH', 0))
+PG_PARTITIONS_AHEAD = int(os.environ.get('PG_PARTITIONS_AHEAD', 3))
+
+BLOB_DIR = os.environ.get('BLOB_DIR', 'camera_frames')
+CAMERA_RING_SIZE = int(os.environ.get('CAMERA_RING_SIZE', 5))
+
+STREAM_MAX_CLIENTS = int(os.environ.get('STREAM_MAX_CLIENTS', 1000))
+STREAM_KEEPALIVE = float(os.environ.get('STREAM_KEEPALIVE', 15))
+STREAM_MIN_INTERVAL = float(os.environ.get('STREAM_MIN_INTERVAL', 0.25))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10000))
+BATCH_MAX_FUTURE = float(os.environ.get('BATCH_MAX_FUTURE', 300))
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 32))
+EMAIL_WORKERS = int(os.environ.get('EMAIL_WORKERS', 2))
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+BCRYPT_QUEUE = int(os.environ.get('BCRYPT_QUEUE', 16))
+
+TOKEN_TTL_DAYS = int(os.environ.get('TOKEN_TTL_DAYS', 7))
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 4096))
+
+RESPONSE_CACHE = os.environ.get('RESPONSE_CACHE', '1') == '1'
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+RESPONSE_CACHE_GZIP_MIN = int(os.environ.get('RESPONSE_CACHE_GZIP_MIN', 1024))
+
+MQTT_TLS = os.environ.get('MQTT_TLS', '1') == '1'
+MQTT_CLIENT_ID = os.environ.get('MQTT_CLIENT_ID', 'iot-backend')
+# Web processes ingest MQTT themselves unless a separate worker.py does it
+MQTT_INGEST = os.environ.get('MQTT_INGEST', '1') == '1'
+# MQTT v5 shared subscription group; empty = every client gets every message
+MQTT_SHARE_GROUP = os.environ.get('MQTT_SHARE_GROUP', 'iot-ingest')
+MQTT_EVENTS_TOPIC = os.environ.get('MQTT_EVENTS_TOPIC', 'iot/events')
+
+CONTROL_ACK_TIMEOUT = float(os.environ.get('CONTROL_ACK_TIMEOUT', 5))
+CONTROL_RETRIES = int(os.environ.get('CONTROL_RETRIES', 2))
+# A command not acked within this many seconds of being queued fails instead of firing late
+CONTROL_TTL = float(os.environ.get('CONTROL_TTL', 2 * CONTROL_ACK_TIMEOUT * (CONTROL_RETRIES + 1)))
+
+PRESENCE_TIMEOUT = float(os.environ.get('PRESENCE_TIMEOUT', 120))
+PRESENCE_TICK = float(os.environ.get('PRESENCE_TICK', 1))
+PRESENCE_WHEEL = int(os.environ.get('PRESENCE_WHEEL', 512))
+
+# auto (orjson if installed) or json
+JSON_BACKEND = os.environ.get('JSON_BACKEND', 'auto')
+
+EXPORT_CHUNK = int(os.environ.get('EXPORT_CHUNK', 5000))
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# Repeated hot-path log lines (same key) are emitted at most once per interval
+LOG_SAMPLE_INTERVAL = float(os.environ.get('LOG_SAMPLE_INTERVAL', 10))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Stack-sample requests slower than this; 0 disables the profiler
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 10))
@@ -0,0 +1,179 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from config import CONTROL_ACK_TIMEOUT, CONTROL_RETRIES, CONTROL_TTL
+
+class ControlDispatcher:
+    # Desired state per slot. A newer command replaces one that is still queued or
+    # waiting for its ack, so a device only ever receives the latest state. Nothing
+    # is sent while the broker is away; the queue waits for the reconnect, but a
+    # command older than ttl fails rather than switching a device hours later.
+    def __init__(self, send, connected, on_ack=None, on_fail=None, ack_timeout=5, retries=2, ttl=30):
+        self.send = send
+        self.connected = connected
+        self.on_ack = on_ack
+        self.on_fail = on_fail
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.ttl = ttl
+        self._pending = OrderedDict()  # slot -> command entry not yet sent
+        self._inflight = {}            # slot -> entry sent, awaiting ack
+        self._cond = threading.Condition()
+        self._seq = itertools.count(1)
+        self._prefix = f"{os.getpid():x}"
+        self._thread = None
+        self._stop = threading.Event()
+        self._latencies = deque(maxlen=1000)
+        self._stats = {'submitted': 0, 'coalesced': 0, 'sent': 0, 'resent': 0, 'send_errors': 0,
+                       'acked': 0, 'failed': 0, 'expired': 0, 'unmatched_acks': 0, 'latency_sum': 0.0, 'max_latency': 0.0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, commands):
+        # commands: [(slot, command)]; queued together so a group goes out in one pass
+        out = []
+        now = time.monotonic()
+        with self._cond:
+            for slot, command in commands:
+                e = {'slot': slot, 'command': command, 'seq': f"{self._prefix}-{next(self._seq)}",
+                     'queued_at': now, 'deadline': now + self.ttl, 'sent_at': None, 'attempts': 0, 'expired': False}
+                if self._pending.pop(slot, None) or self._inflight.pop(slot, None):
+                    self._stats['coalesced'] += 1
+                self._pending[slot] = e
+                self._stats['submitted'] += 1
+                out.append(e['seq'])
+            self._cond.notify()
+        return out
+
+    def ack(self, slot, seq=None, state=None):
+        # Devices echo seq; older firmware only reports its state, which must match
+        with self._cond:
+            e = self._inflight.get(slot)
+            if e is None or (e['seq'] != seq if seq is not None else e['command'] != state):
+                self._stats['unmatched_acks'] += 1
+                return False
+            del self._inflight[slot]
+            latency = time.monotonic() - e['queued_at']
+            self._latencies.append(latency)
+            self._stats['acked'] += 1
+            self._stats['latency_sum'] += latency
+            self._stats['max_latency'] = max(self._stats['max_latency'], latency)
+        if self.on_ack:
+            self.on_ack(e, latency)
+        return True
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='control', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _due(self, now):
+        due, failed = [], []
+        for queue in (self._pending, self._inflight):
+            for slot, e in list(queue.items()):
+                if now >= e['deadline']:
+                    del queue[slot]
+                    e['expired'] = True
+                    self._stats['expired'] += 1
+                    failed.append(e)
+        for slot, e in list(self._inflight.items()):
+            if now - e['sent_at'] < self.ack_timeout:
+                continue
+            if e['attempts'] > self.retries:
+                del self._inflight[slot]
+                self._stats['failed'] += 1
+                failed.append(e)
+            elif self.connected():
+                # stays in flight so an ack racing the resend still matches
+                self._stats['resent'] += 1
+                due.append(e)
+        if self.connected():
+            due.extend(self._pending.values())
+            self._pending.clear()
+        return due, failed
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                if not self._pending or not self.connected():
+                    self._cond.wait(min(self.ack_timeout, 0.5))
+                due, failed = self._due(time.monotonic())
+            errors = 0
+            for e in due:
+                slot = e['slot']
+                with self._cond:
+                    if self._pending.get(slot) is not None or (e['attempts'] and self._inflight.get(slot) is not e):
+                        continue  # superseded or acked since _due
+                    # in flight before it is published, so an ack that beats send() back still matches
+                    before = e['sent_at'], e['attempts']
+                    e['sent_at'] = time.monotonic()
+                    e['attempts'] += 1
+                    self._inflight[slot] = e
+                ok = self.send(e)
+                with self._cond:
+                    if ok:
+                        self._stats['sent'] += 1
+                        continue
+                    errors += 1
+                    self._stats['send_errors'] += 1
+                    if self._inflight.get(slot) is not e:
+                        continue  # superseded while sending
+                    e['sent_at'], e['attempts'] = before
+                    if not e['attempts']:
+                        del self._inflight[slot]
+                        self._pending[slot] = e
+            for e in failed:
+                if self.on_fail: self.on_fail(e)
+            if errors:
+                self._stop.wait(0.5)
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s['pending'] = len(self._pending)
+            s['inflight'] = len(self._inflight)
+            lat = sorted(self._latencies)
+        s['avg_latency'] = s['latency_sum'] / s['acked'] if s['acked'] else 0.0
+        s['p50_latency'] = lat[len(lat) // 2] if lat else None
+        s['p99_latency'] = lat[min(int(len(lat) * 0.99), len(lat) - 1)] if lat else None
+        return s
+
+def _send(e):
+    from mqtt_handler import send_control
+    return send_control(e)
+
+def _connected():
+    from mqtt_handler import mqtt_connected
+    return mqtt_connected
+
+def _acked(e, latency):
+    # Only now is the command known to be applied. Runs on the MQTT network thread, so the
+    # state is stored through the ingest pipeline rather than with a DB round trip here.
+    from ingest import pipeline
+    from events import hub
+    pipeline.submit(e['slot'], e['command'])
+    hub.publish('control', e['slot'], command=e['command'], seq=e['seq'], status='acked', latency=round(latency * 1000))
+
+def _failed(e):
+    from events import hub
+    hub.publish('control', e['slot'], command=e['command'], seq=e['seq'], status='expired' if e['expired'] else 'failed')
+    if e['expired']:
+        print(f"❌ Control Slot {e['slot']}: expired after {e['attempts']} attempts")
+    else:
+        print(f"❌ Control Slot {e['slot']}: no ack after {e['attempts']} attempts")
+
+dispatcher = ControlDispatcher(_send, _connected, _acked, _failed, ack_timeout=CONTROL_ACK_TIMEOUT, retries=CONTROL_RETRIES,
+                               ttl=CONTROL_TTL)
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+
+class Subscriber:
+    # Holds at most one pending event per (type, slot): a fast slot overwrites its
+    # unsent value instead of queueing, so slow clients never build a backlog.
+    def __init__(self, slots=None):
+        self.slots = slots
+        self.pending = OrderedDict()
+        self.cond = threading.Condition()
+        self.waker = None  # set by async consumers, called from the publishing thread
+
+    def wants(self, evt):
+        return self.slots is None or evt.get('slot') is None or evt['slot'] in self.slots
+
+    def offer(self, evt):
+        key = (evt['type'], evt.get('slot'))
+        with self.cond:
+            replaced = self.pending.pop(key, None) is not None
+            self.pending[key] = evt
+            self.cond.notify()
+        if self.waker:
+            self.waker()
+        return replaced
+
+    def take(self):
+        with self.cond:
+            out = list(self.pending.values())
+            self.pending.clear()
+        return out
+
+    def drain(self, timeout):
+        with self.cond:
+            if not self.pending:
+                self.cond.wait(timeout)
+        return self.take()
+
+# Events that happen wherever ingestion runs and must reach every web process
+RELAYED = ('data', 'camera', 'control')
+
+class EventHub:
+    def __init__(self):
+        self.relay = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._subs = set()
+        self._stats = {'published': 0, 'delivered': 0, 'coalesced': 0}
+
+    def subscribe(self, slots=None):
+        sub = Subscriber(slots)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def publish(self, etype, slot=None, **data):
+        evt = dict(data, type=etype, slot=slot) if slot is not None else dict(data, type=etype)
+        if self.relay and etype in RELAYED:
+            self.relay(evt)
+        self.deliver(evt)
+
+    def listen(self, fn):
+        # In-process consumers called synchronously with every delivered event
+        self._listeners.append(fn)
+
+    def deliver(self, evt):
+        # Local fan-out only; also the entry point for events relayed from other processes
+        with self._lock:
+            subs = list(self._subs)
+            self._stats['published'] += 1
+        for fn in self._listeners:
+            fn(evt)
+        delivered = coalesced = 0
+        for sub in subs:
+            if sub.wants(evt):
+                delivered += 1
+                coalesced += sub.offer(evt)
+        with self._lock:
+            self._stats['delivered'] += delivered
+            self._stats['coalesced'] += coalesced
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['subscribers'] = len(self._subs)
+        return s
+
+hub = EventHub()
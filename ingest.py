@@ -0,0 +1,229 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+import metrics
+from spool import SegmentSpool
+from config import (INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_PUT_TIMEOUT,
+                    SPOOL_DIR, SPOOL_SEGMENT_MB, SPOOL_MAX_MB, SPOOL_REPLAY_BATCH, SPOOL_RETRY_INTERVAL,
+                    SPOOL_MAX_REPLAYS)
+
+class IngestPipeline:
+    def __init__(self, write, batch_size=500, flush_interval=0.5, queue_size=10000, put_timeout=0,
+                 spool_dir=None, spool_opts=None, replay_batch=5000, retry_interval=5, max_replays=5):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.spool_dir = spool_dir
+        self.spool_opts = spool_opts or {}
+        self.replay_batch = replay_batch
+        self.retry_interval = retry_interval
+        self.max_replays = max_replays
+        self.spool = None
+        self._down_until = self._replay_until = 0
+        self._stored_at = self._refused_at = 0
+        self._refusals = 0
+        self._thread = self._drainer = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'dropped': 0, 'overflows': 0, 'blocked': 0, 'written': 0,
+                       'rejected': 0, 'discarded': 0, 'failed': 0, 'batches': 0, 'size_flushes': 0, 'deadline_flushes': 0,
+                       'max_batch': 0, 'flush_time': 0.0, 'spooled': 0, 'replayed': 0, 'replay_batches': 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def submit(self, slot, value, ts=None):
+        # samples without a device clock get their arrival time, not the time their batch is written
+        if not ts:
+            ts = int(time.time() * 1000)
+        try:
+            self.queue.put_nowait((slot, value, ts))
+        except queue.Full:
+            self._count('overflows')
+            try:
+                if self.put_timeout <= 0: raise queue.Full
+                self.queue.put((slot, value, ts), timeout=self.put_timeout)
+                self._count('blocked')
+            except queue.Full:
+                # the DB is behind: park the sample on disk rather than block the MQTT thread
+                if self.spool and self._spool([(slot, value, ts)]):
+                    return True
+                self._count('dropped')
+                return False
+        self._count('enqueued')
+        return True
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        if self.spool_dir and self.spool is None:
+            try:
+                self.spool = SegmentSpool.claim(self.spool_dir, **self.spool_opts)
+            except Exception as e:
+                metrics.log.error("Spool disabled: %s", e)
+        self._thread = threading.Thread(target=self._run, name='ingest', daemon=True)
+        self._thread.start()
+        if self.spool:
+            self._drainer = threading.Thread(target=self._drain, name='ingest-drain', daemon=True)
+            self._drainer.start()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        for t in (self._thread, self._drainer):
+            if t:
+                t.join(timeout)
+        if self.spool:
+            self.spool.close()
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch, 'size_flushes' if len(batch) >= self.batch_size else 'deadline_flushes')
+
+    def _flush(self, batch, reason):
+        if self.spool and time.monotonic() < self._down_until:
+            self._spool(batch)
+            return
+        start = time.perf_counter()
+        written, discarded, rest, error = self._store(batch)
+        if rest:
+            if self.spool:
+                self._down_until = time.monotonic() + self.retry_interval
+                metrics.sampled(logging.ERROR, 'ingest', "Ingest Error: %s (%d samples spooled)", error, len(rest))
+                self._spool(rest)
+            else:
+                metrics.sampled(logging.ERROR, 'ingest', "Ingest Error: %s (%d samples lost)", error, len(rest))
+                self._count('failed', len(rest))
+        with self._lock:
+            s = self._stats
+            s['written'] += written
+            s['rejected'] += len(batch) - len(rest) - written - discarded
+            s['discarded'] += discarded
+            if not rest:
+                s['batches'] += 1
+                s[reason] += 1
+                s['max_batch'] = max(s['max_batch'], len(batch))
+                s['flush_time'] += time.perf_counter() - start
+
+    def _store(self, batch, force=False):
+        # -> (written, discarded, unstored, error). A refused batch is bisected so a row the
+        # DB will never take (say an out-of-range ts) is discarded on its own instead of
+        # taking the rest down with it. Two lone rows refused back to back, or nothing
+        # stored at all, look like an outage: what's left comes back unstored. force treats
+        # every refused row as bad.
+        written = discarded = 0
+        stored, misses, error = False, [], None
+        parts = [batch]
+        while parts:
+            part = parts.pop()
+            try:
+                written += self.write(part)
+                stored = True
+                self._stored_at = time.monotonic()
+                discarded += len(misses)
+                misses = []
+                continue
+            except Exception as e:
+                error = e
+            if len(part) > 1:
+                mid = len(part) // 2
+                parts += [part[mid:], part[:mid]]
+                continue
+            metrics.sampled(logging.WARNING, 'ingest-row', "Sample %r refused: %s", part[0], error)
+            if force:
+                discarded += 1
+                continue
+            misses.append(part[0])
+            if len(misses) >= 2:
+                return written, discarded, misses + [x for p in reversed(parts) for x in p], error
+        if misses and not stored:
+            return written, discarded, misses, error
+        return written, discarded + len(misses), [], error
+
+    def _spool(self, batch):
+        try:
+            ok = self.spool.append(batch)
+        except Exception as e:
+            # a sample the serializer can't encode goes alone, not with its batch
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                return self._spool(batch[:mid]) & self._spool(batch[mid:])
+            metrics.sampled(logging.ERROR, 'ingest-spool', "Sample %r not spooled: %s", batch[0], e)
+            ok = False
+        self._count('spooled' if ok else 'failed', len(batch))
+        return ok
+
+    def _drain(self):
+        idle = True
+        while not self._stop.wait(self.flush_interval if idle else 0):
+            idle = True
+            if time.monotonic() < max(self._down_until, self._replay_until):
+                continue
+            samples, cursor = self.spool.read(self.replay_batch)
+            if not samples:
+                continue
+            # a replay refused again although the DB has stored something since the last
+            # refusal is refused for its rows, not an outage; after max_replays of those
+            # its bad rows are discarded so the records behind it get through
+            force = self._refusals >= self.max_replays
+            written, discarded, rest, error = self._store(samples, force)
+            requeued = 0
+            if rest and (written or discarded):
+                # partly stored before the DB went away: requeue the remainder, don't replay it all twice
+                self._spool(rest)
+                requeued, rest = len(rest), []
+            if rest:
+                if self._stored_at > self._refused_at:
+                    self._refusals += 1
+                self._refused_at = time.monotonic()
+                self._replay_until = self._refused_at + self.retry_interval
+                metrics.sampled(logging.WARNING, 'ingest-drain', "Spool replay failed: %s", error)
+                continue
+            self._refusals = 0
+            self.spool.commit(cursor, len(samples) - requeued)
+            with self._lock:
+                s = self._stats
+                s['replayed'] += written
+                s['rejected'] += len(samples) - requeued - written - discarded
+                s['discarded'] += discarded
+                s['replay_batches'] += 1
+            idle = False
+
+    def spool_stats(self):
+        return self.spool.stats() if self.spool else {}
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s['queued'] = self.queue.qsize()
+        s['capacity'] = self.queue.maxsize
+        return s
+
+def _write(batch):
+    from models import save_slot_data_batch
+    return save_slot_data_batch(batch)
+
+pipeline = IngestPipeline(_write, batch_size=INGEST_BATCH_SIZE, flush_interval=INGEST_FLUSH_INTERVAL,
+                          queue_size=INGEST_QUEUE_SIZE, put_timeout=INGEST_PUT_TIMEOUT, spool_dir=SPOOL_DIR,
+                          spool_opts={'segment_bytes': SPOOL_SEGMENT_MB << 20, 'max_bytes': SPOOL_MAX_MB << 20},
+                          replay_batch=SPOOL_REPLAY_BATCH, retry_interval=SPOOL_RETRY_INTERVAL,
+                          max_replays=SPOOL_MAX_REPLAYS)
+atexit.register(pipeline.stop)
@@ -0,0 +1,219 @@
+import logging
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as _Tally
+from config import LOG_LEVEL, LOG_SAMPLE_INTERVAL, PROFILE_SLOW_MS, PROFILE_INTERVAL_MS
+
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+log = logging.getLogger('iot')
+
+# Seconds; Prometheus-style cumulative buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, n=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + n
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.labels, k)} {v}" for k, v in items]
+        return out
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self._values = {}  # labels -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+                    break
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for k, v in items:
+            acc = 0
+            for b, n in zip(self.buckets, v):
+                acc += n
+                out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), k + (repr(b),))} {acc}")
+            out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), k + ('+Inf',))} {v[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labels, k)} {v[-2]}")
+            out.append(f"{self.name}_count{_labels(self.labels, k)} {v[-1]}")
+        return out
+
+def _labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+http_requests = Histogram('iot_http_request_duration_seconds', 'HTTP request latency by route', ('method', 'route', 'status'))
+db_queries = Histogram('iot_db_query_duration_seconds', 'Time inside q() by statement kind and table', ('op', 'table'))
+db_errors = Counter('iot_db_query_errors_total', 'Failed q() calls', ('op', 'table'))
+mqtt_messages = Counter('iot_mqtt_messages_total', 'MQTT messages received', ('topic',))
+mqtt_handler = Histogram('iot_mqtt_handler_duration_seconds', 'on_message time by topic', ('topic',))
+mqtt_errors = Counter('iot_mqtt_handler_errors_total', 'on_message failures by topic', ('topic',))
+METRICS = [http_requests, db_queries, db_errors, mqtt_messages, mqtt_handler, mqtt_errors]
+
+# name -> fn returning a stats dict; numeric entries become gauges
+_collectors = {}
+
+def collect(name, fn):
+    _collectors[name] = fn
+
+def render():
+    out = []
+    for m in METRICS:
+        out += m.render()
+    for name, fn in _collectors.items():
+        try:
+            stats = fn()
+        except Exception as e:
+            sampled(logging.WARNING, f'collect:{name}', "metrics collector %s failed: %s", name, e)
+            continue
+        for k, v in stats.items():
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                continue
+            metric = f"iot_{name}_{k}"
+            out += [f"# TYPE {metric} gauge", f"{metric} {v}"]
+    return '\n'.join(out) + '\n'
+
+_QUERY = re.compile(r'^\s*(\w+)\b.*?\b(?:FROM|INTO|UPDATE|JOIN)\s+(\w+)', re.I | re.S)
+_fingerprints = {}
+
+def fingerprint(query):
+    # q() is called with a small set of fixed statements, so this cache stays bounded
+    fp = _fingerprints.get(query)
+    if fp is None:
+        m = _QUERY.match(query)
+        op = query.split(None, 1)[0].upper() if query.strip() else '?'
+        fp = (op, m.group(2).lower() if m else '-')
+        if len(_fingerprints) < 1000:
+            _fingerprints[query] = fp
+    return fp
+
+# ===== SAMPLED LOGGING =====
+_log_lock = threading.Lock()
+_log_seen = {}
+
+def sampled(level, key, msg, *args):
+    # At most one line per key every LOG_SAMPLE_INTERVAL seconds; the rest are counted
+    if not log.isEnabledFor(level):
+        return
+    now = time.monotonic()
+    with _log_lock:
+        last, suppressed = _log_seen.get(key, (None, 0))
+        if last is not None and now - last < LOG_SAMPLE_INTERVAL:
+            _log_seen[key] = (last, suppressed + 1)
+            return
+        _log_seen[key] = (now, 0)
+    if suppressed:
+        msg += f" (+{suppressed} suppressed)"
+    log.log(level, msg, *args)
+
+# ===== SLOW REQUEST PROFILER =====
+try:
+    from gevent import monkey as _monkey
+    import greenlet as _greenlet
+except ImportError:
+    _monkey = None
+
+class SlowRequestProfiler:
+    # Opt-in (PROFILE_SLOW_MS > 0). A sampler thread looks at requests running longer
+    # than the threshold and tallies their current stacks per route. Requests are OS
+    # threads (sync/gthread workers, the ASGI pool) or, under gevent workers, greenlets:
+    # there the sampler is a real OS thread, so it still runs while a request hogs the
+    # hub, and reads a switched-out greenlet's stack from its saved frame.
+    def __init__(self, slow_ms, interval_ms, max_stacks=50):
+        self.slow = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.max_stacks = max_stacks
+        self._active = {}
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._gevent = None
+
+    @property
+    def enabled(self):
+        return self.slow > 0
+
+    def _key(self):
+        return _greenlet.getcurrent() if self._gevent else threading.get_ident()
+
+    def begin(self, route):
+        if not self.enabled: return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._start()
+        self._active[self._key()] = (route, time.monotonic(), self._thread_id())
+
+    def end(self):
+        if not self.enabled: return
+        self._active.pop(self._key(), None)
+
+    def _start(self):
+        # decided on the first request: gunicorn's gevent worker patches after this module loads
+        self._gevent = _monkey is not None and _monkey.is_module_patched('threading')
+        if self._gevent:
+            self._thread_id = _monkey.get_original('_thread', 'get_ident')
+            self._sleep = _monkey.get_original('time', 'sleep')
+            _monkey.get_original('_thread', 'start_new_thread')(self._run, ())
+            self._thread = True
+        else:
+            self._thread_id, self._sleep = threading.get_ident, time.sleep
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._sleep(self.interval)
+            now = time.monotonic()
+            frames = None
+            for key, (route, start, ident) in list(self._active.items()):
+                if now - start < self.slow:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                # a switched-out greenlet keeps its frame; a running one is its thread's current frame
+                frame = getattr(key, 'gr_frame', None) or frames.get(ident)
+                if frame is None:
+                    continue
+                stack = ''.join(traceback.format_stack(frame, limit=25))
+                with self._lock:
+                    tally = self._samples.setdefault(route, _Tally())
+                    if stack in tally or len(tally) < self.max_stacks:
+                        tally[stack] += 1
+
+    def report(self, top=5):
+        with self._lock:
+            return {route: [{'samples': n, 'stack': s} for s, n in tally.most_common(top)]
+                    for route, tally in self._samples.items()}
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_MS, PROFILE_INTERVAL_MS)
@@ -1,5 +1,24 @@
 import os
-from config import DATABASE_URL, MAX_SLOTS
+import re
+import math
+import base64
+import time
+import datetime
+import logging
+from contextlib import contextmanager
+from config import (DATABASE_URL, MAX_SLOTS, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                    DB_POOL_IDLE_TIMEOUT, DB_POOL_PING_AFTER, SLOT_CACHE_CHECK_INTERVAL, LAST_VALUE_CACHE,
+                    MIGRATE_CHUNK, RAW_RETENTION_DAYS, ROLLUP_1M_RETENTION_DAYS, ROLLUP_1H_RETENTION_DAYS,
+                    ROLLUP_1D_RETENTION_DAYS, COMPACT_CHUNK, COMPACT_MAX_CHUNKS, BLOB_DIR, CAMERA_RING_SIZE,
+                    TOKEN_TTL_DAYS, EXPORT_CHUNK, SQLITE_TUNED, SQLITE_SYNCHRONOUS, SQLITE_CACHE_MB,
+                    SQLITE_MMAP_MB, SQLITE_BUSY_TIMEOUT, SQLITE_GROUP_MAX, PG_PARTITION_DAYS,
+                    PG_PARTITION_SLOT_HASH, PG_PARTITIONS_AHEAD)
+from pool import ConnectionPool
+from sqlite_engine import SQLiteEngine
+import metrics
+from blobstore import BlobStore
+from events import hub
+from registry import SlotRegistry, LastValueTable, RevocationList
 
 if DATABASE_URL:
     import pg8000
@@ -20,18 +39,78 @@ else:
     import sqlite3
     USE_POSTGRES = False
     DATABASE_PATH = "iot_database.db"
-    print("✅ SQLite")
+    print("✅ SQLite" + (" (WAL)" if SQLITE_TUNED else ""))
 
-def get_db():
+engine = None
+if not USE_POSTGRES and SQLITE_TUNED:
+    engine = SQLiteEngine(DATABASE_PATH, synchronous=SQLITE_SYNCHRONOUS, cache_mb=SQLITE_CACHE_MB, mmap_mb=SQLITE_MMAP_MB,
+                          busy_timeout=SQLITE_BUSY_TIMEOUT, group_max=SQLITE_GROUP_MAX)
+
+def connect_db():
     if USE_POSTGRES:
         return pg8000.connect(**PG_CONFIG)
-    conn = sqlite3.connect(DATABASE_PATH)
+    if engine:
+        # only init_db still takes pooled connections; give them the same pragmas
+        conn = engine.connect()
+        conn.isolation_level = ''
+        return conn
+    conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
+def _ping(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT 1")
+    cur.fetchone()
+    cur.close()
+
+# Connections are shared by gunicorn request threads and the MQTT network thread,
+# one user at a time; rollback on release so none sits idle inside a transaction.
+pool = ConnectionPool(connect_db, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                      idle_timeout=DB_POOL_IDLE_TIMEOUT, ping_after=DB_POOL_PING_AFTER,
+                      ping=_ping, reset=lambda conn: conn.rollback())
+
+def get_db():
+    return pool.acquire()
+
+def put_db(conn, discard=False):
+    pool.release(conn, discard)
+
+def get_db_stats():
+    return pool.stats()
+
+def get_sqlite_stats():
+    return engine.stats() if engine else {}
+
 def get_cursor(conn):
     return conn.cursor()
 
+def sql(query):
+    return query.replace('?', '%s') if USE_POSTGRES else query
+
+@contextmanager
+def transaction():
+    if engine:
+        try:
+            with engine.transaction() as cur:
+                yield cur
+        except Exception as e:
+            metrics.sampled(logging.ERROR, 'db', "DB Error: %s", e)
+            raise e
+        return
+    conn = get_db()
+    cur = get_cursor(conn)
+    try:
+        yield cur
+        conn.commit()
+    except Exception as e:
+        metrics.sampled(logging.ERROR, 'db', "DB Error: %s", e)
+        raise e
+    finally:
+        try: cur.close()
+        except: pass
+        put_db(conn)
+
 def dict_row_convert(row, description):
     if row is None:
         return None
@@ -41,23 +120,66 @@ def dict_row_convert(row, description):
         return dict(zip(columns, row))
     return dict(row)
 
+def dict_rows(rows, description):
+    # Column names once per cursor, not once per row
+    columns = [col[0] for col in description]
+    return [dict(zip(columns, r)) for r in rows]
+
+def run_write(fn):
+    # fn(cursor) in a transaction; with the tuned SQLite engine it joins the writer's next group commit
+    if engine:
+        return engine.write(fn)
+    with transaction() as cur:
+        return fn(cur)
+
+@contextmanager
+def snapshot():
+    # A read-only transaction: every statement in it sees the same committed state
+    if engine:
+        cur = engine.reader().cursor()
+        cur.execute("BEGIN")
+        try:
+            yield cur
+        finally:
+            if cur.connection.in_transaction: cur.execute("COMMIT")
+            cur.close()
+        return
+    with transaction() as cur:
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ" if USE_POSTGRES else "BEGIN")
+        yield cur
+
+def _q_engine(query, params, one, all):
+    start = time.perf_counter()
+    try:
+        if one or all:
+            cur = engine.reader().execute(query, params or ())
+            try:
+                return dict_row_convert(cur.fetchone(), cur.description) if one else dict_rows(cur.fetchall(), cur.description)
+            finally:
+                cur.close()
+        return engine.write(lambda cur: cur.execute(query, params or ()).lastrowid)
+    except Exception as e:
+        metrics.db_errors.inc(*metrics.fingerprint(query))
+        metrics.sampled(logging.ERROR, 'db', "DB Error: %s", e)
+        raise e
+    finally:
+        metrics.db_queries.observe(time.perf_counter() - start, *metrics.fingerprint(query))
+
 def q(query, params=None, one=False, all=False):
+    if engine:
+        return _q_engine(query, params, one, all)
     conn = get_db()
     cur = get_cursor(conn)
     if USE_POSTGRES and params:
         query = query.replace('?', '%s')
+    start = time.perf_counter()
     try:
         cur.execute(query, params) if params else cur.execute(query)
         if one:
             r = cur.fetchone()
-            desc = cur.description
-            cur.close(); conn.close()
-            return dict_row_convert(r, desc)
+            return dict_row_convert(r, cur.description)
         elif all:
-            r = cur.fetchall()
-            desc = cur.description
-            cur.close(); conn.close()
-            return [dict_row_convert(x, desc) for x in r]
+            return dict_rows(cur.fetchall(), cur.description)
         else:
             conn.commit()
             lid = None
@@ -69,18 +191,219 @@ def q(query, params=None, one=False, all=False):
                 except: pass
             else:
                 lid = cur.lastrowid
-            cur.close(); conn.close()
             return lid
     except Exception as e:
-        print(f"DB Error: {e}")
-        try:
-            cur.close(); conn.close()
-        except: pass
+        metrics.db_errors.inc(*metrics.fingerprint(query))
+        metrics.sampled(logging.ERROR, 'db', "DB Error: %s", e)
         raise e
+    finally:
+        metrics.db_queries.observe(time.perf_counter() - start, *metrics.fingerprint(query))
+        try: cur.close()
+        except: pass
+        put_db(conn)
+
+def _table_columns(cur, table):
+    if USE_POSTGRES:
+        cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
+        return set(r[0] for r in cur.fetchall())
+    cur.execute(f"PRAGMA table_info({table})")
+    return set(r[1] for r in cur.fetchall())
+
+def _detach_legacy_slot_data(cur):
+    # slot_data used to hold every sample as TEXT with a TIMESTAMP; move it aside for the typed table
+    cols = _table_columns(cur, 'slot_data')
+    if 'created_at' in cols and 'ts' not in cols and not _table_columns(cur, 'slot_data_legacy'):
+        cur.execute("DROP INDEX IF EXISTS idx_slot_data_slot_time")
+        cur.execute("ALTER TABLE slot_data RENAME TO slot_data_legacy")
+
+# Legacy TEXT values matching this move to value_num, everything else stays text. No '?' or '%'
+# in it: pg8000 uses format paramstyle
+NUMERIC_TEXT = r"^\s*[-+]{0,1}([0-9]+[.]{0,1}[0-9]*|[.][0-9]+)([eE][-+]{0,1}[0-9]+){0,1}\s*$"
+
+def _migrate_legacy_slot_data(conn, cur):
+    # Copies in id-ordered chunks, keeping ids, so an interrupted migration resumes where it stopped
+    if not _table_columns(cur, 'slot_data_legacy'):
+        return
+    if USE_POSTGRES:
+        ts, num = "(EXTRACT(EPOCH FROM created_at) * 1000)::bigint", "value::float8"
+        is_num = f"value ~ '{NUMERIC_TEXT}'"
+    else:
+        ts, num = "CAST(strftime('%s', created_at) AS INTEGER) * 1000", "CAST(value AS REAL)"
+        # SQLite has no regex operator; GLOB would pass '1-2' or '2024-01-01', so use the same grammar in Python
+        numeric = re.compile(NUMERIC_TEXT)
+        conn.create_function('is_numeric', 1, lambda v: isinstance(v, str) and numeric.match(v) is not None, deterministic=True)
+        is_num = "is_numeric(value)"
+    if PARTITIONED:
+        _partitions_for(cur, 'slot_data_legacy', ts)
+        conn.commit()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM slot_data")
+    done = cur.fetchone()[0]
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM slot_data_legacy")
+    last = cur.fetchone()[0]
+    while done < last:
+        hi = done + MIGRATE_CHUNK
+        cur.execute(f"""INSERT INTO slot_data (id, slot_number, ts, value_num, value_text)
+                        SELECT id, slot_number, {ts}, CASE WHEN {is_num} THEN {num} END, CASE WHEN {is_num} THEN NULL ELSE value END
+                        FROM slot_data_legacy WHERE id > {done} AND id <= {hi}""")
+        conn.commit()
+        done = hi
+        print(f"🔄 slot_data migrated up to id {min(done, last)}/{last}")
+    if USE_POSTGRES:
+        cur.execute("SELECT setval(pg_get_serial_sequence('slot_data', 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM slot_data), false)")
+    cur.execute("DROP TABLE slot_data_legacy")
+    conn.commit()
+
+def _migrate_camera_images(conn, cur):
+    # Frames used to be base64 TEXT in camera_images; move them into the blob store
+    if not _table_columns(cur, 'camera_images'):
+        return
+    cur.execute("SELECT slot_number, image_data, created_at FROM camera_images")
+    for num, img, created in cur.fetchall():
+        if isinstance(created, str):
+            created = datetime.datetime.strptime(created[:19], '%Y-%m-%d %H:%M:%S')
+        try:
+            _save_frame(cur, num, decode_image(img), to_ms(created) if created else now_ms())
+        except ValueError as e:
+            print(f"⚠️ Camera {num}: skipped undecodable frame ({e})")
+    cur.execute("DROP TABLE camera_images")
+    conn.commit()
+
+# ===== PARTITIONS =====
+# Postgres with PG_PARTITION_DAYS > 0: slot_data is partitioned by ts range (optionally hash
+# sub-partitioned by slot), so range queries only touch the partitions they cover and expired
+# data goes away as whole partitions. Compaction keeps PG_PARTITIONS_AHEAD future partitions
+# around; inserts outside every partition (backfills, odd device clocks) create theirs first.
+PARTITION_MS = PG_PARTITION_DAYS * 86400000
+PARTITIONED = USE_POSTGRES and PARTITION_MS > 0
+_partitions = {'ranges': [], 'covered': set(), 'created': 0, 'dropped': 0}
+
+def _slot_data_kind(cur):
+    cur.execute("SELECT c.relkind FROM pg_class c WHERE c.relname = 'slot_data' AND pg_table_is_visible(c.oid)")
+    r = cur.fetchone()
+    return r[0] if r else None
+
+def _partition_ranges(cur):
+    cur.execute("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+                   JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'slot_data'::regclass""")
+    ranges = []
+    for name, bound in cur.fetchall():
+        b = re.findall(r"\d+", bound)  # FOR VALUES FROM ('lo') TO ('hi')
+        if len(b) == 2:
+            ranges.append((int(b[0]), int(b[1]), name))
+    return sorted(ranges)
+
+def _load_partitions(cur):
+    # covered: PARTITION_MS-aligned buckets fully inside existing partitions, checked per insert
+    ranges = _partition_ranges(cur)
+    covered = {}
+    for lo, hi, _ in ranges:
+        for k in range(lo // PARTITION_MS, (hi - 1) // PARTITION_MS + 1):
+            covered[k] = covered.get(k, 0) + min(hi, (k + 1) * PARTITION_MS) - max(lo, k * PARTITION_MS)
+    _partitions['ranges'] = ranges
+    _partitions['covered'] = set(k for k, n in covered.items() if n >= PARTITION_MS)
+
+def _create_partition(cur, lo, hi):
+    name = "slot_data_p" + time.strftime('%Y%m%d' if lo % 86400000 == 0 else '%Y%m%d_%H%M%S', time.gmtime(lo // 1000))
+    if PG_PARTITION_SLOT_HASH > 0:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF slot_data FOR VALUES FROM ({lo}) TO ({hi}) PARTITION BY HASH (slot_number)")
+        for i in range(PG_PARTITION_SLOT_HASH):
+            cur.execute(f"CREATE TABLE {name}_h{i} PARTITION OF {name} FOR VALUES WITH (MODULUS {PG_PARTITION_SLOT_HASH}, REMAINDER {i})")
+    else:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF slot_data FOR VALUES FROM ({lo}) TO ({hi})")
+    _partitions['created'] += 1
+
+def _fill_partitions(cur, buckets):
+    # Creates partitions for whatever part of each bucket no partition covers yet, so
+    # partitions made with an earlier PG_PARTITION_DAYS are left as they are
+    cur.execute("SELECT pg_advisory_xact_lock(31339)")
+    ranges = _partition_ranges(cur)
+    for k in sorted(set(buckets)):
+        lo, hi = k * PARTITION_MS, (k + 1) * PARTITION_MS
+        for a, b, _ in ranges:
+            if b <= lo or a >= hi: continue
+            if a > lo: _create_partition(cur, lo, a)
+            lo = max(lo, b)
+        if lo < hi: _create_partition(cur, lo, hi)
+
+def _partitions_for(cur, table, ts):
+    # every partition rows of table will need once copied into slot_data
+    cur.execute(f"SELECT DISTINCT ({ts}) / {PARTITION_MS} FROM {table}")
+    _fill_partitions(cur, [int(r[0]) for r in cur.fetchall() if r[0] is not None])
+
+def _ensure_partitions(stamps):
+    # Own transaction, committed before the insert that needs it
+    need = set(ts // PARTITION_MS for ts in stamps) - _partitions['covered']
+    if not need: return
+    with transaction() as cur:
+        _fill_partitions(cur, need)
+    with transaction() as cur:
+        _load_partitions(cur)
+
+def _drop_expired_partitions(wm):
+    # Whole partitions older than every slot's retention, and already rolled up, are dropped
+    keep = [RAW_RETENTION_DAYS] + [(slot_registry.get(n) or {}).get('retention_days') for n in slot_registry.numbers()]
+    keep = [RAW_RETENTION_DAYS if d is None else d for d in keep]
+    if min(keep) <= 0: return 0
+    horizon = now_ms() - max(keep) * 86400000
+    dropped = 0
+    with _compaction_tx() as cur:
+        if cur is None: return 0
+        for lo, hi, name in _partition_ranges(cur):
+            if hi > horizon: break
+            cur.execute(f"SELECT MAX(id) FROM {name}")
+            top = cur.fetchone()[0]
+            if top is not None and top > wm: continue
+            cur.execute(f"DROP TABLE {name}")
+            dropped += 1
+        if dropped:
+            bump_version('data', cur)
+    if dropped:
+        last_values.invalidate()
+        with transaction() as cur:
+            _load_partitions(cur)
+        _partitions['dropped'] += dropped
+    return dropped
+
+def maintain_partitions(wm):
+    k = now_ms() // PARTITION_MS
+    _ensure_partitions([(k + i) * PARTITION_MS for i in range(PG_PARTITIONS_AHEAD + 1)])
+    return _drop_expired_partitions(wm)
+
+def get_partition_stats():
+    if not PARTITIONED: return {}
+    ranges = _partitions['ranges']
+    return {'partitions': len(ranges), 'created': _partitions['created'], 'dropped': _partitions['dropped'],
+            'oldest': ranges[0][0] if ranges else None, 'newest': ranges[-1][1] if ranges else None}
+
+def _migrate_unpartitioned_slot_data(conn, cur):
+    # Copies a plain slot_data into the partitioned one in id chunks, keeping ids; resumes if interrupted
+    if not _table_columns(cur, 'slot_data_unpartitioned'):
+        return
+    _partitions_for(cur, 'slot_data_unpartitioned', 'ts')
+    conn.commit()
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM slot_data")
+    done = cur.fetchone()[0]
+    cur.execute("SELECT COALESCE(MAX(id), 0) FROM slot_data_unpartitioned")
+    last = cur.fetchone()[0]
+    while done < last:
+        hi = done + MIGRATE_CHUNK
+        cur.execute(f"""INSERT INTO slot_data (id, slot_number, ts, value_num, value_text)
+                        SELECT id, slot_number, ts, value_num, value_text FROM slot_data_unpartitioned
+                        WHERE id > {done} AND id <= {hi}""")
+        conn.commit()
+        done = hi
+        print(f"🔄 slot_data partitioned up to id {min(done, last)}/{last}")
+    cur.execute("SELECT setval(pg_get_serial_sequence('slot_data', 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM slot_data), false)")
+    cur.execute("DROP TABLE slot_data_unpartitioned")
+    conn.commit()
 
 def init_db():
     conn = get_db()
     cur = get_cursor(conn)
+    if USE_POSTGRES:
+        # every gunicorn worker runs init_db; let one at a time create and migrate
+        cur.execute("SELECT pg_advisory_lock(31337)")
+    _detach_legacy_slot_data(cur)
     
     if USE_POSTGRES:
         cur.execute('''CREATE TABLE IF NOT EXISTS users (
@@ -94,16 +417,33 @@ def init_db():
             name TEXT NOT NULL, type TEXT NOT NULL, icon TEXT DEFAULT '📟',
             unit TEXT DEFAULT '', location TEXT DEFAULT '', stream_url TEXT,
             is_active INTEGER DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS slot_data (
-            id SERIAL PRIMARY KEY, slot_number INTEGER NOT NULL,
-            value TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS camera_images (
-            id SERIAL PRIMARY KEY, slot_number INTEGER UNIQUE NOT NULL,
-            image_data TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        kind = _slot_data_kind(cur)
+        if PARTITIONED:
+            if kind == 'r':
+                # the plain table moves aside and is copied in by _migrate_unpartitioned_slot_data
+                cur.execute("ALTER TABLE slot_data RENAME TO slot_data_unpartitioned")
+            # the key has to contain ts; (slot_number, ts, id) also serves every history lookup
+            cur.execute('''CREATE TABLE IF NOT EXISTS slot_data (
+                id BIGSERIAL, slot_number INTEGER NOT NULL, ts BIGINT NOT NULL,
+                value_num DOUBLE PRECISION, value_text TEXT,
+                PRIMARY KEY (slot_number, ts, id)) PARTITION BY RANGE (ts)''')
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_slot_data_id ON slot_data (id)")
+        elif kind == 'p':
+            raise RuntimeError("slot_data is partitioned; set PG_PARTITION_DAYS")
+        else:
+            cur.execute('''CREATE TABLE IF NOT EXISTS slot_data (
+                id SERIAL PRIMARY KEY, slot_number INTEGER NOT NULL, ts BIGINT NOT NULL,
+                value_num DOUBLE PRECISION, value_text TEXT)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS camera_frames (
+            slot_number INTEGER NOT NULL, pos INTEGER NOT NULL, seq BIGINT NOT NULL,
+            digest TEXT NOT NULL, size INTEGER NOT NULL, content_type TEXT NOT NULL, ts BIGINT NOT NULL,
+            PRIMARY KEY (slot_number, pos))''')
         cur.execute('''CREATE TABLE IF NOT EXISTS reset_codes (
             id SERIAL PRIMARY KEY, email TEXT NOT NULL,
             code TEXT NOT NULL, expires_at TIMESTAMP NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)''')
     else:
         cur.execute('''CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL,
@@ -117,17 +457,45 @@ def init_db():
             unit TEXT DEFAULT '', location TEXT DEFAULT '', stream_url TEXT,
             is_active INTEGER DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
         cur.execute('''CREATE TABLE IF NOT EXISTS slot_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, slot_number INTEGER NOT NULL,
-            value TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-        cur.execute('''CREATE TABLE IF NOT EXISTS camera_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, slot_number INTEGER UNIQUE NOT NULL,
-            image_data TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+            id INTEGER PRIMARY KEY AUTOINCREMENT, slot_number INTEGER NOT NULL, ts INTEGER NOT NULL,
+            value_num REAL, value_text TEXT)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS camera_frames (
+            slot_number INTEGER NOT NULL, pos INTEGER NOT NULL, seq INTEGER NOT NULL,
+            digest TEXT NOT NULL, size INTEGER NOT NULL, content_type TEXT NOT NULL, ts INTEGER NOT NULL,
+            PRIMARY KEY (slot_number, pos))''')
         cur.execute('''CREATE TABLE IF NOT EXISTS reset_codes (
             id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT NOT NULL,
             code TEXT NOT NULL, expires_at TIMESTAMP NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)''')
     
+    if not PARTITIONED:
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_slot_data_slot_ts ON slot_data (slot_number, ts, id)")
+    real = "DOUBLE PRECISION" if USE_POSTGRES else "REAL"
+    for table, _, _ in ROLLUP_TIERS:
+        cur.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+            slot_number INTEGER NOT NULL, bucket BIGINT NOT NULL, v_min {real}, v_max {real}, v_sum {real},
+            n INTEGER NOT NULL, v_last {real}, last_ts BIGINT NOT NULL, PRIMARY KEY (slot_number, bucket))''')
+    cur.execute("CREATE TABLE IF NOT EXISTS token_revocations (user_id INTEGER PRIMARY KEY, revoked_at BIGINT NOT NULL)")
+    # revoked_at used to be whole seconds; as ms, the end of that second still rejects every token issued in it
+    cur.execute("UPDATE token_revocations SET revoked_at = revoked_at * 1000 + 999 WHERE revoked_at < 100000000000")
+    cur.execute("CREATE TABLE IF NOT EXISTS rollup_state (name TEXT PRIMARY KEY, watermark BIGINT NOT NULL DEFAULT 0)")
+    cur.execute(sql("INSERT INTO rollup_state (name, watermark) VALUES (?, 0) ON CONFLICT (name) DO NOTHING"), ('slot_data',))
+    if 'retention_days' not in _table_columns(cur, 'slots'):
+        cur.execute("ALTER TABLE slots ADD COLUMN retention_days INTEGER")
+    for name in CACHE_VERSIONS:
+        cur.execute("INSERT INTO cache_versions (name, version) VALUES (%s, 0) ON CONFLICT (name) DO NOTHING" if USE_POSTGRES
+                    else "INSERT INTO cache_versions (name, version) VALUES (?, 0) ON CONFLICT (name) DO NOTHING", (name,))
     conn.commit()
+    _migrate_legacy_slot_data(conn, cur)
+    if PARTITIONED:
+        _migrate_unpartitioned_slot_data(conn, cur)
+        k = now_ms() // PARTITION_MS
+        _fill_partitions(cur, range(k, k + PG_PARTITIONS_AHEAD + 1))
+        conn.commit()
+        _load_partitions(cur)
+    _migrate_camera_images(conn, cur)
     
     # Create admin
     cur.execute("SELECT id FROM users WHERE email = 'admin@admin.com'")
@@ -135,18 +503,58 @@ def init_db():
         from auth import hash_password
         pw = hash_password('admin123')
         if USE_POSTGRES:
-            cur.execute("INSERT INTO users (email, password_hash, name, role) VALUES (%s, %s, %s, %s)",
+            cur.execute("INSERT INTO users (email, password_hash, name, role) VALUES (%s, %s, %s, %s) ON CONFLICT (email) DO NOTHING",
                        ('admin@admin.com', pw, 'Administrator', 'admin'))
         else:
-            cur.execute("INSERT INTO users (email, password_hash, name, role) VALUES (?, ?, ?, ?)",
+            # several workers may get here at once on a fresh SQLite file
+            cur.execute("INSERT INTO users (email, password_hash, name, role) VALUES (?, ?, ?, ?) ON CONFLICT (email) DO NOTHING",
                        ('admin@admin.com', pw, 'Administrator', 'admin'))
         conn.commit()
         print("✅ Created admin: admin@admin.com / admin123")
     
-    cur.close(); conn.close()
+    if USE_POSTGRES:
+        cur.execute("SELECT pg_advisory_unlock(31337)")
+        conn.commit()
+    cur.close(); put_db(conn)
+    slot_registry.invalidate()
     print("✅ Database OK!")
 
+# ===== CACHE VERSIONS =====
+# Shared counters that let each worker's in-memory caches notice writes made by other workers.
+CACHE_VERSIONS = ('slots', 'data', 'auth')
+
+def get_version(name):
+    r = q("SELECT version FROM cache_versions WHERE name = ?", (name,), one=True)
+    return r['version'] if r else 0
+
+def bump_version(name, cur=None):
+    if cur is None:
+        return run_write(lambda cur: bump_version(name, cur))
+    cur.execute(sql("UPDATE cache_versions SET version = version + 1 WHERE name = ?"), (name,))
+    cur.execute(sql("SELECT version FROM cache_versions WHERE name = ?"), (name,))
+    r = cur.fetchone()
+    return r[0] if r else 0
+
 # ===== USER =====
+revocations = RevocationList(lambda: [(r['user_id'], r['revoked_at']) for r in q("SELECT user_id, revoked_at FROM token_revocations", all=True)],
+                             lambda: get_version('auth'), SLOT_CACHE_CHECK_INTERVAL)
+
+def _revoke_tokens(cur, uid):
+    # Entries older than the token lifetime can't match any live token
+    now = now_ms()
+    cur.execute(sql("DELETE FROM token_revocations WHERE revoked_at < ?"), (now - TOKEN_TTL_DAYS * 86400000,))
+    cur.execute(sql("INSERT INTO token_revocations (user_id, revoked_at) VALUES (?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET revoked_at = excluded.revoked_at"), (uid, now))
+    bump_version('auth', cur)
+
+def token_revoked(payload):
+    # iat_ms where the token has it; older tokens only carry whole-second iat
+    issued = payload.get('iat_ms') or (payload.get('iat') or 0) * 1000
+    return revocations.revoked(payload.get('user_id'), issued)
+
+def get_revocation_stats():
+    return revocations.stats()
+
 def get_user_by_email(email):
     return q("SELECT * FROM users WHERE email = ?", (email,), one=True)
 
@@ -164,7 +572,10 @@ def get_all_users():
     return q("SELECT id, email, name, role, avatar, theme, language, created_at FROM users ORDER BY created_at DESC", all=True)
 
 def update_user_role(uid, role):
-    q("UPDATE users SET role = ? WHERE id = ?", (role, uid))
+    with transaction() as cur:
+        cur.execute(sql("UPDATE users SET role = ? WHERE id = ?"), (role, uid))
+        _revoke_tokens(cur, uid)
+    revocations.invalidate()
 
 def update_user_profile(uid, name=None, avatar=None, theme=None, language=None):
     user = get_user_by_id(uid)
@@ -178,70 +589,459 @@ def update_user_password(uid, new_pw):
     q("UPDATE users SET password_hash = ? WHERE id = ?", (hash_password(new_pw), uid))
 
 def delete_user(uid):
-    q("DELETE FROM users WHERE id = ?", (uid,))
+    with transaction() as cur:
+        cur.execute(sql("DELETE FROM users WHERE id = ?"), (uid,))
+        _revoke_tokens(cur, uid)
+    revocations.invalidate()
 
 def admin_reset_password(uid, new_pw):
     from auth import hash_password
     q("UPDATE users SET password_hash = ? WHERE id = ?", (hash_password(new_pw), uid))
 
 # ===== SLOT =====
+slot_registry = SlotRegistry(lambda: q("SELECT * FROM slots ORDER BY slot_number", all=True),
+                             lambda: get_version('slots'), SLOT_CACHE_CHECK_INTERVAL)
+
+def _slots_changed():
+    bump_version('slots')
+    slot_registry.invalidate()
+
 def get_all_slots():
-    return q("SELECT * FROM slots WHERE is_active = 1 ORDER BY slot_number", all=True)
+    return slot_registry.all()
 
 def get_slot_by_number(num):
-    return q("SELECT * FROM slots WHERE slot_number = ?", (num,), one=True)
+    return slot_registry.get(num)
+
+def get_slot_cache_stats():
+    return slot_registry.stats()
+
+def get_slots_version():
+    return slot_registry.current()
+
+def _bad_retention(days):
+    # None: the RAW_RETENTION_DAYS default; 0: keep raw rows forever
+    if days is not None and (isinstance(days, bool) or not isinstance(days, int) or days < 0):
+        return "retention_days phải là số nguyên >= 0"
 
-def create_slot(num, name, stype, icon='📟', unit='', loc='', stream=''):
+def create_slot(num, name, stype, icon='📟', unit='', loc='', stream='', retention=None):
     if num < 1 or num > MAX_SLOTS:
         return None, f"Slot 1-{MAX_SLOTS}"
+    if _bad_retention(retention):
+        return None, _bad_retention(retention)
     try:
-        sid = q("INSERT INTO slots (slot_number,name,type,icon,unit,location,stream_url) VALUES (?,?,?,?,?,?,?)",
-               (num, name, stype, icon, unit, loc, stream))
-        return sid, None
+        sid = q("INSERT INTO slots (slot_number,name,type,icon,unit,location,stream_url,retention_days) VALUES (?,?,?,?,?,?,?,?)",
+               (num, name, stype, icon, unit, loc, stream, retention))
     except:
         return None, f"Slot {num} đã tồn tại"
+    _slots_changed()
+    return sid, None
 
-def update_slot(num, name=None, stype=None, icon=None, unit=None, loc=None, stream=None):
+def update_slot(num, name=None, stype=None, icon=None, unit=None, loc=None, stream=None, retention=None, reset_retention=False):
+    # None leaves a field as it is; reset_retention puts the slot back on the default retention
     if not get_slot_by_number(num):
         return False, "Slot không tồn tại"
-    q("UPDATE slots SET name=COALESCE(?,name), type=COALESCE(?,type), icon=COALESCE(?,icon), unit=COALESCE(?,unit), location=COALESCE(?,location), stream_url=COALESCE(?,stream_url) WHERE slot_number=?",
-      (name, stype, icon, unit, loc, stream, num))
+    if _bad_retention(retention):
+        return False, _bad_retention(retention)
+    keep = "NULL" if reset_retention else "COALESCE(?,retention_days)"
+    q(f"UPDATE slots SET name=COALESCE(?,name), type=COALESCE(?,type), icon=COALESCE(?,icon), unit=COALESCE(?,unit), location=COALESCE(?,location), stream_url=COALESCE(?,stream_url), retention_days={keep} WHERE slot_number=?",
+      (name, stype, icon, unit, loc, stream) + (() if reset_retention else (retention,)) + (num,))
+    _slots_changed()
     return True, None
 
+def _delete_slot_rows(table, col, num, chunk=COMPACT_CHUNK):
+    # Oldest first, at most ~chunk rows per transaction, so a long history never becomes one huge delete
+    while True:
+        with transaction() as cur:
+            cur.execute(sql(f"SELECT {col} FROM {table} WHERE slot_number = ? ORDER BY {col} LIMIT 1 OFFSET ?"), (num, chunk))
+            r = cur.fetchone()
+            if r is None:
+                cur.execute(sql(f"DELETE FROM {table} WHERE slot_number = ?"), (num,))
+                return
+            cur.execute(sql(f"DELETE FROM {table} WHERE slot_number = ? AND {col} < ?"), (num, r[0]))
+            if cur.rowcount == 0:
+                # more than chunk rows share the first value
+                cur.execute(sql(f"DELETE FROM {table} WHERE slot_number = ? AND {col} = ?"), (num, r[0]))
+
 def delete_slot(num):
-    q("DELETE FROM slot_data WHERE slot_number = ?", (num,))
-    q("DELETE FROM camera_images WHERE slot_number = ?", (num,))
+    _delete_slot_rows('slot_data', 'ts', num)
+    for table, _, _ in ROLLUP_TIERS:
+        _delete_slot_rows(table, 'bucket', num)
+    version = bump_version('data')
+    last_values.remove(num, version)
+    with transaction() as cur:
+        cur.execute(sql("SELECT digest FROM camera_frames WHERE slot_number = ?"), (num,))
+        digests = set(r[0] for r in cur.fetchall())
+        cur.execute(sql("DELETE FROM camera_frames WHERE slot_number = ?"), (num,))
+        for d in digests: _release_blob(cur, d)
     q("DELETE FROM slots WHERE slot_number = ?", (num,))
+    _slots_changed()
 
 def get_available_slot_numbers():
-    slots = q("SELECT slot_number FROM slots WHERE is_active = 1", all=True)
-    used = set(s['slot_number'] for s in slots)
+    used = set(s['slot_number'] for s in get_all_slots())
     return [i for i in range(1, MAX_SLOTS + 1) if i not in used]
 
 # ===== DATA =====
+# Numeric samples live in value_num, anything else (e.g. "on") in value_text; ts is epoch milliseconds.
+if USE_POSTGRES:
+    # Postgres can't COALESCE a float with text, so _typed() merges the two columns instead
+    VALUE_COLUMNS = "value_num AS value, value_text"
+else:
+    VALUE_COLUMNS = "COALESCE(value_num, value_text) AS value"
+
+def _typed(rows):
+    if USE_POSTGRES:
+        for r in rows:
+            t = r.pop('value_text')
+            if r['value'] is None: r['value'] = t
+    return rows
+
+def split_value(val):
+    if isinstance(val, bool):
+        return float(val), None
+    try:
+        f = float(val)
+    except (TypeError, ValueError):
+        return None, str(val)
+    return (f, None) if math.isfinite(f) else (None, str(val))
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def to_ms(dt):
+    return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+def _load_latest():
+    # One indexed probe per slot on (slot_number, ts, id), in a single statement
+    return _typed(q(f"""SELECT d.slot_number, {VALUE_COLUMNS}, d.ts FROM slots s JOIN slot_data d ON d.id = (
+                        SELECT id FROM slot_data WHERE slot_number = s.slot_number ORDER BY ts DESC, id DESC LIMIT 1)""", all=True))
+
+last_values = LastValueTable(_load_latest, lambda: get_version('data'), SLOT_CACHE_CHECK_INTERVAL)
+
+def _insert_slot_data(cur, rows):
+    # rows: [(slot, ts, value_num, value_text)]
+    if USE_POSTGRES:
+        # pg8000 executemany is one round trip per row; send multi-row INSERTs instead (4 params a row, 65535 max)
+        cur.execute("SELECT pg_advisory_xact_lock_shared(31340)")  # see _committed_max_id
+        for i in range(0, len(rows), 10000):
+            part = rows[i:i + 10000]
+            cur.execute("INSERT INTO slot_data (slot_number, ts, value_num, value_text) VALUES " + ",".join(["(%s,%s,%s,%s)"] * len(part)),
+                        [x for r in part for x in r])
+    else:
+        cur.executemany("INSERT INTO slot_data (slot_number, ts, value_num, value_text) VALUES (?, ?, ?, ?)", rows)
+
+def _apply_latest(rows, version):
+    newest = {}
+    for n, ts, v, t in rows:
+        if n not in newest or ts >= newest[n]['ts']:
+            newest[n] = {'slot_number': n, 'value': v if v is not None else t, 'ts': ts}
+    # backfilled samples older than what clients already have are stored but not pushed as "live"
+    fresh = [r for r in newest.values() if (last_values.peek(r['slot_number']) or r)['ts'] <= r['ts']]
+    last_values.apply(list(newest.values()), version)
+    for r in fresh:
+        hub.publish('data', r['slot_number'], value=r['value'], ts=r['ts'])
+
 def save_slot_data(num, val):
-    return q("INSERT INTO slot_data (slot_number, value) VALUES (?, ?)", (num, str(val)))
+    row = (num, now_ms()) + split_value(val)
+    if PARTITIONED: _ensure_partitions([row[1]])
+    run_write(lambda cur: _insert_slot_data(cur, [row]))
+    version = bump_version('data')
+    _apply_latest([row], version)
+
+def save_slot_data_many(items):
+    # items: [(slot, value, ts_ms)], already validated; one transaction for the lot
+    if not items: return 0
+    rows = [(num, ts) + split_value(val) for num, val, ts in items]
+    if PARTITIONED: _ensure_partitions([r[1] for r in rows])
+    run_write(lambda cur: _insert_slot_data(cur, rows))
+    # bumped in its own short transaction: inside the insert, the shared cache_versions row
+    # lock would serialize every writer in every process until the insert commits
+    version = bump_version('data')
+    _apply_latest(rows, version)
+    return len(rows)
+
+def save_slot_data_batch(samples):
+    # samples: [(slot, value, ts_ms or None)] from ingestion; unknown slots are skipped
+    known = slot_registry.numbers()
+    now = now_ms()
+    items = []
+    for num, val, ts in samples:
+        try: num = int(num)
+        except (TypeError, ValueError): continue
+        if num in known:
+            items.append((num, val, ts or now))
+    return save_slot_data_many(items)
 
 def get_latest_slot_data(num):
-    return q("SELECT * FROM slot_data WHERE slot_number = ? ORDER BY created_at DESC LIMIT 1", (num,), one=True)
+    if LAST_VALUE_CACHE:
+        return last_values.get(num)
+    r = q(f"SELECT slot_number, {VALUE_COLUMNS}, ts FROM slot_data WHERE slot_number = ? ORDER BY ts DESC, id DESC LIMIT 1", (num,), one=True)
+    return _typed([r])[0] if r else None
 
 def get_all_latest_data():
-    data = {}
-    for s in get_all_slots():
-        d = get_latest_slot_data(s['slot_number'])
-        if d: data[s['slot_number']] = d
-    return data
+    rows = last_values.all().values() if LAST_VALUE_CACHE else _load_latest()
+    active = set(s['slot_number'] for s in get_all_slots())
+    return {r['slot_number']: r for r in rows if r['slot_number'] in active}
+
+def get_last_value_stats():
+    return last_values.stats()
+
+def get_data_version():
+    # Local writes advance this immediately; other workers' within SLOT_CACHE_CHECK_INTERVAL
+    return last_values.current()
 
-def get_slot_history(num, limit=100):
-    return q("SELECT * FROM slot_data WHERE slot_number = ? ORDER BY created_at DESC LIMIT ?", (num, limit), all=True)
+def get_slot_history(num, limit=100, start=None, end=None):
+    if start is None:
+        return _typed(q(f"SELECT id, slot_number, {VALUE_COLUMNS}, ts FROM slot_data WHERE slot_number = ? ORDER BY ts DESC, id DESC LIMIT ?",
+                        (num, limit), all=True))
+    return _typed(q(f"""SELECT id, slot_number, {VALUE_COLUMNS}, ts FROM slot_data WHERE slot_number = ? AND ts >= ? AND ts < ?
+                        ORDER BY ts DESC, id DESC LIMIT ?""", (num, to_ms(start), to_ms(end), limit), all=True))
+
+def iter_slot_history(nums, start, end, chunk=EXPORT_CHUNK):
+    # Keyset pages on (ts, id) per slot, oldest first. Each page is its own short query,
+    # so memory stays at one page and no connection is held while the client reads.
+    lo, hi = to_ms(start), to_ms(end)
+    for num in nums:
+        after = (lo, -1)
+        while True:
+            rows = _typed(q(f"""SELECT id, slot_number, {VALUE_COLUMNS}, ts FROM slot_data
+                                WHERE slot_number = ? AND ts >= ? AND ts < ? AND (ts > ? OR id > ?)
+                                ORDER BY ts, id LIMIT ?""", (num, after[0], hi, after[0], after[1], chunk), all=True))
+            if not rows: break
+            yield rows
+            if len(rows) < chunk: break
+            after = (rows[-1]['ts'], rows[-1]['id'])
+
+def _fetch_all(cur, query, params):
+    cur.execute(sql(query), params)
+    return dict_rows(cur.fetchall(), cur.description)
+
+def _raw_buckets(cur, num, lo, hi, w, after_id=None):
+    extra = " AND id > ?" if after_id is not None else ""
+    params = (num, lo, hi) + ((after_id,) if after_id is not None else ())
+    return _fetch_all(cur, f"""SELECT bucket AS t, MIN(value_num) AS v_min, MAX(value_num) AS v_max, SUM(value_num) AS v_sum, COUNT(*) AS n,
+                        MAX(lastv) AS v_last, MAX(ts) AS last_ts
+                 FROM (SELECT ts / {w} * {w} AS bucket, ts, value_num,
+                              FIRST_VALUE(value_num) OVER (PARTITION BY ts / {w} ORDER BY ts DESC, id DESC) AS lastv
+                       FROM slot_data WHERE slot_number = ? AND ts >= ? AND ts < ?{extra} AND value_num IS NOT NULL) b
+                 GROUP BY bucket""", params)
+
+def _rollup_buckets(cur, table, num, lo, hi, w):
+    return _fetch_all(cur, f"""SELECT t, MIN(v_min) AS v_min, MAX(v_max) AS v_max, SUM(v_sum) AS v_sum, SUM(n) AS n,
+                        MAX(lastv) AS v_last, MAX(last_ts) AS last_ts
+                 FROM (SELECT bucket / {w} * {w} AS t, v_min, v_max, v_sum, n, last_ts,
+                              FIRST_VALUE(v_last) OVER (PARTITION BY bucket / {w} ORDER BY last_ts DESC) AS lastv
+                       FROM {table} WHERE slot_number = ? AND bucket >= ? AND bucket < ?) b
+                 GROUP BY t""", (num, lo, hi))
+
+def _merge_buckets(rows):
+    out = {}
+    for r in rows:
+        b = out.get(r['t'])
+        if b is None:
+            out[r['t']] = dict(r)
+            continue
+        b['v_min'], b['v_max'] = min(b['v_min'], r['v_min']), max(b['v_max'], r['v_max'])
+        b['v_sum'] += r['v_sum']; b['n'] += r['n']
+        if r['last_ts'] >= b['last_ts']:
+            b['v_last'], b['last_ts'] = r['v_last'], r['last_ts']
+    return [{'t': t, 'min': b['v_min'], 'max': b['v_max'], 'avg': b['v_sum'] / b['n'], 'count': b['n'], 'last': b['v_last']}
+            for t, b in sorted(out.items())]
+
+def _rollup_tier(lo, width):
+    # Coarsest rollup whose buckets nest exactly in width-second buckets and whose retention still covers the range start
+    now = now_ms()
+    for table, g, days in reversed(ROLLUP_TIERS):
+        if width % g == 0 and (days <= 0 or lo >= now - days * 86400000):
+            return table, g
+    return None, None
+
+def get_slot_history_buckets(num, start, end, width):
+    # min/max/avg/count/last of the numeric samples per width-second bucket; t is the bucket start in ms
+    w = int(width) * 1000
+    lo, hi = to_ms(start), to_ms(end)
+    table, g = _rollup_tier(lo, width)
+    # Whole rollup buckets inside [lo, hi) come from the rollup, the partial ones at either end from raw rows
+    g = (g or 0) * 1000
+    a, b = (-(-lo // g) * g, hi // g * g) if table else (hi, hi)
+    with snapshot() as cur:
+        if a >= b:
+            return _merge_buckets(_raw_buckets(cur, num, lo, hi, w))
+        # Rows up to the watermark are already in the rollup; only newer (or late backfilled) ones come from raw.
+        # One snapshot, so a compaction committing in between can't count rows on both sides of the watermark.
+        wm = get_rollup_watermark(cur)
+        return _merge_buckets(_rollup_buckets(cur, table, num, a, b, w) + _raw_buckets(cur, num, a, b, w, wm) +
+                              _raw_buckets(cur, num, lo, a, w) + _raw_buckets(cur, num, b, hi, w))
+
+# ===== RETENTION / ROLLUPS =====
+# (table, bucket seconds, retention days; 0 keeps forever). Raw rows are folded into every tier
+# in id order behind a single watermark, so late backfilled rows still land in their buckets.
+ROLLUP_TIERS = (('slot_data_1m', 60, ROLLUP_1M_RETENTION_DAYS),
+                ('slot_data_1h', 3600, ROLLUP_1H_RETENTION_DAYS),
+                ('slot_data_1d', 86400, ROLLUP_1D_RETENTION_DAYS))
+
+if USE_POSTGRES:
+    LEAST, GREATEST = "LEAST", "GREATEST"
+else:
+    LEAST, GREATEST = "MIN", "MAX"
+
+@contextmanager
+def _compaction_tx():
+    # One compactor at a time across workers: advisory lock on Postgres, write lock up front on SQLite
+    with transaction() as cur:
+        if USE_POSTGRES:
+            cur.execute("SELECT pg_try_advisory_xact_lock(31338)")
+            yield cur if cur.fetchone()[0] else None
+        else:
+            if not engine:  # engine transactions already begin immediate
+                cur.execute("BEGIN IMMEDIATE")
+            yield cur
+
+def get_rollup_watermark(cur=None):
+    if cur is None:
+        r = q("SELECT watermark FROM rollup_state WHERE name = 'slot_data'", one=True)
+        return r['watermark'] if r else 0
+    cur.execute("SELECT watermark FROM rollup_state WHERE name = 'slot_data'")
+    r = cur.fetchone()
+    return r[0] if r else 0
+
+def _committed_max_id():
+    # Postgres hands out ids before commit, so a lower id can become visible after higher ones.
+    # Inserts hold this lock shared until they commit; taking it exclusively for a moment means
+    # every id up to MAX(id) is committed and the watermark never moves past a row in flight.
+    # SQLite writers hold the database lock from id assignment to commit, so MAX(id) is safe.
+    with transaction() as cur:
+        if USE_POSTGRES:
+            cur.execute("SELECT pg_advisory_xact_lock(31340)")
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM slot_data")
+        return cur.fetchone()[0]
+
+def _rollup_chunk(chunk, top):
+    with _compaction_tx() as cur:
+        if cur is None: return False
+        wm = get_rollup_watermark(cur)
+        cur.execute(sql("SELECT id FROM slot_data WHERE id > ? AND id <= ? ORDER BY id LIMIT 1 OFFSET ?"), (wm, top, chunk - 1))
+        r = cur.fetchone()
+        more = r is not None
+        hi = r[0] if more else top
+        if hi <= wm: return False
+        for table, g, _ in ROLLUP_TIERS:
+            g *= 1000
+            cur.execute(sql(f"""INSERT INTO {table} (slot_number, bucket, v_min, v_max, v_sum, n, v_last, last_ts)
+                SELECT slot_number, bucket, MIN(value_num), MAX(value_num), SUM(value_num), COUNT(*), MAX(lastv), MAX(ts)
+                FROM (SELECT slot_number, ts / {g} * {g} AS bucket, ts, value_num,
+                             FIRST_VALUE(value_num) OVER (PARTITION BY slot_number, ts / {g} ORDER BY ts DESC, id DESC) AS lastv
+                      FROM slot_data WHERE id > ? AND id <= ? AND value_num IS NOT NULL) b
+                GROUP BY slot_number, bucket
+                ON CONFLICT (slot_number, bucket) DO UPDATE SET
+                    v_min = {LEAST}({table}.v_min, excluded.v_min), v_max = {GREATEST}({table}.v_max, excluded.v_max),
+                    v_sum = {table}.v_sum + excluded.v_sum, n = {table}.n + excluded.n,
+                    v_last = CASE WHEN excluded.last_ts >= {table}.last_ts THEN excluded.v_last ELSE {table}.v_last END,
+                    last_ts = {GREATEST}({table}.last_ts, excluded.last_ts)"""), (wm, hi))
+        cur.execute(sql("UPDATE rollup_state SET watermark = ? WHERE name = 'slot_data'"), (hi,))
+        return more
+
+def _expire_chunk(table, col, num, cutoff, chunk, max_id=None):
+    # Deletes at most ~chunk rows older than cutoff, so no single statement holds locks for long
+    with _compaction_tx() as cur:
+        if cur is None: return 0
+        cur.execute(sql(f"SELECT {col} FROM {table} WHERE slot_number = ? AND {col} < ? ORDER BY {col} LIMIT 1 OFFSET ?"),
+                    (num, cutoff, chunk))
+        r = cur.fetchone()
+        bound = r[0] if r else cutoff
+        if max_id is None:
+            cur.execute(sql(f"DELETE FROM {table} WHERE slot_number = ? AND {col} < ?"), (num, bound))
+        else:
+            # never drop raw rows the rollups haven't seen yet
+            cur.execute(sql(f"DELETE FROM {table} WHERE slot_number = ? AND {col} < ? AND id <= ?"), (num, bound, max_id))
+        return max(cur.rowcount, 0)
+
+def _expire(table, col, num, days, chunk, max_chunks, max_id=None):
+    if days <= 0: return 0
+    cutoff = now_ms() - days * 86400000
+    total = 0
+    for _ in range(max_chunks):
+        n = _expire_chunk(table, col, num, cutoff, chunk, max_id)
+        total += n
+        if n < chunk: break
+    return total
+
+def compact_slot_data(chunk=COMPACT_CHUNK, max_chunks=COMPACT_MAX_CHUNKS):
+    rolled = 0
+    top = _committed_max_id()
+    while rolled < max_chunks and _rollup_chunk(chunk, top):
+        rolled += 1
+    wm = get_rollup_watermark()
+    dropped = maintain_partitions(wm) if PARTITIONED else 0
+    expired = 0
+    for num in slot_registry.numbers():
+        slot = slot_registry.get(num) or {}
+        days = slot.get('retention_days')
+        if _bad_retention(days): days = None  # stored before retention_days was validated
+        expired += _expire('slot_data', 'ts', num, RAW_RETENTION_DAYS if days is None else days, chunk, max_chunks, wm)
+        for table, _, tdays in ROLLUP_TIERS:
+            expired += _expire(table, 'bucket', num, tdays, chunk, max_chunks)
+    return {'watermark': wm, 'expired': expired, 'partitions_dropped': dropped}
 
 # ===== CAMERA =====
+# Frame bytes live in a content-addressed BlobStore; camera_frames only keeps metadata for a ring of the
+# last CAMERA_RING_SIZE frames per slot, overwritten in place (pos = seq % ring) rather than delete + insert.
+blobs = BlobStore(BLOB_DIR)
+
+def decode_image(img):
+    if isinstance(img, (bytes, bytearray)):
+        return bytes(img)
+    if img.startswith('data:'):
+        img = img.split(',', 1)[1]
+    try:
+        return base64.b64decode(img, validate=True)
+    except Exception:
+        raise ValueError("invalid base64 image")
+
+def image_type(data):
+    if data[:3] == b'\xff\xd8\xff': return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n': return 'image/png'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP': return 'image/webp'
+    return 'application/octet-stream'
+
+def _release_blob(cur, digest):
+    cur.execute(sql("SELECT 1 FROM camera_frames WHERE digest = ? LIMIT 1"), (digest,))
+    if not cur.fetchone():
+        blobs.delete(digest)
+
+def _save_frame(cur, num, data, ts):
+    digest = blobs.put(data)
+    cur.execute(sql("SELECT COALESCE(MAX(seq), 0) + 1 FROM camera_frames WHERE slot_number = ?"), (num,))
+    seq = cur.fetchone()[0]
+    pos = seq % max(CAMERA_RING_SIZE, 1)
+    cur.execute(sql("SELECT digest FROM camera_frames WHERE slot_number = ? AND pos = ?"), (num, pos))
+    old = cur.fetchone()
+    cur.execute(sql("""INSERT INTO camera_frames (slot_number, pos, seq, digest, size, content_type, ts) VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (slot_number, pos) DO UPDATE SET seq = excluded.seq, digest = excluded.digest,
+                       size = excluded.size, content_type = excluded.content_type, ts = excluded.ts"""),
+                (num, pos, seq, digest, len(data), image_type(data), ts))
+    if old and old[0] != digest:
+        _release_blob(cur, old[0])
+    return {'slot_number': num, 'seq': seq, 'digest': digest, 'size': len(data), 'content_type': image_type(data), 'ts': ts}
+
 def save_camera_image(num, img):
-    q("DELETE FROM camera_images WHERE slot_number = ?", (num,))
-    q("INSERT INTO camera_images (slot_number, image_data) VALUES (?, ?)", (num, img))
+    data = decode_image(img)
+    with transaction() as cur:
+        frame = _save_frame(cur, num, data, now_ms())
+    hub.publish('camera', num, seq=frame['seq'], etag=frame['digest'], ts=frame['ts'])
+    return frame
+
+def get_camera_image(num, seq=None):
+    if seq is None:
+        return q("SELECT slot_number, seq, digest, size, content_type, ts FROM camera_frames WHERE slot_number = ? ORDER BY seq DESC LIMIT 1",
+                 (num,), one=True)
+    return q("SELECT slot_number, seq, digest, size, content_type, ts FROM camera_frames WHERE slot_number = ? AND seq = ?", (num, seq), one=True)
 
-def get_camera_image(num):
-    return q("SELECT * FROM camera_images WHERE slot_number = ?", (num,), one=True)
+def get_camera_frames(num):
+    return q("SELECT slot_number, seq, digest, size, content_type, ts FROM camera_frames WHERE slot_number = ? ORDER BY seq DESC",
+             (num,), all=True)
+
+def camera_frame_path(digest):
+    return blobs.path(digest)
 
 # ===== RESET PASSWORD =====
 def create_reset_code(email):
@@ -270,16 +1070,17 @@ def reset_password(email, new_pw):
 
 # ===== DASHBOARD =====
 def get_dashboard_stats():
-    t = q("SELECT COUNT(*) as count FROM slots WHERE is_active = 1", one=True)
-    c = q("SELECT COUNT(*) as count FROM slots WHERE is_active = 1 AND type = 'camera'", one=True)
-    co = q("SELECT COUNT(*) as count FROM slots WHERE is_active = 1 AND type = 'control'", one=True)
-    ch = q("SELECT COUNT(*) as count FROM slots WHERE is_active = 1 AND type = 'chart'", one=True)
-    return {
-        'total_slots': t['count'] if t else 0,
-        'total_cameras': c['count'] if c else 0,
-        'total_controls': co['count'] if co else 0,
-        'total_charts': ch['count'] if ch else 0
-    }
+    return slot_registry.view()[1]
+
+def get_dashboard_snapshot():
+    # Stats, slot list and latest values from one registry view and the last-value table
+    slots, stats = slot_registry.view()
+    rows = last_values.all() if LAST_VALUE_CACHE else {r['slot_number']: r for r in _load_latest()}
+    data = {}
+    for s in slots:
+        r = rows.get(s['slot_number'])
+        if r: data[s['slot_number']] = r
+    return stats, slots, data
 
 if __name__ == '__main__':
     init_db()
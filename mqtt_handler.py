@@ -1,41 +1,100 @@
 import paho.mqtt.client as mqtt
 import ssl
-import json
-from config import MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD
+import os
+import socket
+import time
+import logging
+import math
+import metrics
+from metrics import log
+from config import (MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TLS, MQTT_CLIENT_ID,
+                    MQTT_SHARE_GROUP, MQTT_EVENTS_TOPIC, BATCH_MAX_FUTURE)
+from ingest import pipeline
+from control import dispatcher
+from presence import presence
+from events import hub
+from timeseries import device_ts
+from serializer import loads, dumps
 
 client = None
+client_id = None
 mqtt_connected = False
+ingesting = False
+relay_in = False
 
-def on_connect(c, userdata, flags, rc):
+INGEST_TOPICS = ("iot/data", "iot/camera")
+
+def ingest_topic(topic):
+    # With a share group the broker hands each message to one member of the group
+    return f"$share/{MQTT_SHARE_GROUP}/{topic}" if MQTT_SHARE_GROUP else topic
+
+def presence_timeout(t):
+    # Seconds from an iot/status payload; anything but a positive number keeps the default
+    if isinstance(t, bool): return None
+    try:
+        t = float(t)
+    except (TypeError, ValueError):
+        return None
+    return t if 0 < t < math.inf else None
+
+def relay_event(evt):
+    if client and mqtt_connected:
+        client.publish(MQTT_EVENTS_TOPIC, dumps(dict(evt, src=client_id)))
+
+def on_connect(c, userdata, flags, rc, properties=None):
     global mqtt_connected
     if rc == 0:
         mqtt_connected = True
-        print("✅ MQTT Connected!")
-        c.subscribe("iot/data")
-        c.subscribe("iot/camera")
-        c.subscribe("iot/status")
+        hub.publish('mqtt', connected=True, broker=MQTT_BROKER)
+        print(f"✅ MQTT Connected! ({client_id})")
+        if ingesting:
+            for topic in INGEST_TOPICS:
+                c.subscribe(ingest_topic(topic))
+        if relay_in:
+            c.subscribe(MQTT_EVENTS_TOPIC)
+        if dispatcher.running:
+            # not shared: acks must reach whichever process sent the command
+            c.subscribe("iot/status", qos=1)
     else:
         mqtt_connected = False
         print(f"❌ MQTT Failed: {rc}")
 
-def on_disconnect(c, userdata, rc):
+def on_disconnect(c, userdata, rc, properties=None):
     global mqtt_connected
     mqtt_connected = False
+    hub.publish('mqtt', connected=False, broker=MQTT_BROKER)
     print("⚠️ MQTT Disconnected")
 
 def on_message(c, userdata, msg):
+    topic = msg.topic
+    start = time.perf_counter()
+    metrics.mqtt_messages.inc(topic)
     try:
-        data = json.loads(msg.payload.decode())
-        topic = msg.topic
+        data = loads(msg.payload)
         
-        if topic == "iot/data":
-            from models import save_slot_data, get_slot_by_number
+        if topic == MQTT_EVENTS_TOPIC:
+            if data.pop('src', None) != client_id:
+                hub.deliver(data)
+        
+        elif topic == "iot/data":
+            # decode and hand off only; the ingest thread validates slots and writes in batches
             slot = data.get('slot')
             value = data.get('value')
             if slot and value is not None:
-                if get_slot_by_number(slot):
-                    save_slot_data(slot, value)
-                    print(f"📊 Slot {slot}: {value}")
+                ts = device_ts(data.get('ts'), time.time() * 1000 + BATCH_MAX_FUTURE * 1000)
+                pipeline.submit(slot, value, ts)
+        
+        elif topic == "iot/status":
+            # {"slot": n | "slots": [...], "status": "online"/"offline", "timeout": s} (a last will
+            # is just an "offline" status), plus "seq"/"state" when acking a control command
+            slots = data.get('slots') or ([data['slot']] if data.get('slot') is not None else [])
+            timeout = presence_timeout(data.get('timeout'))
+            for n in slots:
+                if data.get('status') == 'offline': presence.offline(int(n))
+                else: presence.touch(int(n), timeout)
+            state = data.get('state', data.get('command'))
+            if data.get('slot') is not None and (data.get('seq') is not None or state is not None):
+                dispatcher.ack(int(data['slot']), data.get('seq'), state)
         
         elif topic == "iot/camera":
             from models import save_camera_image, get_slot_by_number
@@ -44,21 +103,39 @@ def on_message(c, userdata, msg):
             if slot and image:
                 if get_slot_by_number(slot):
                     save_camera_image(slot, image)
-                    print(f"📷 Camera {slot} updated")
+                    log.debug("📷 Camera %s updated", slot)
     except Exception as e:
-        print(f"MQTT Error: {e}")
+        metrics.mqtt_errors.inc(topic)
+        metrics.sampled(logging.WARNING, f'mqtt:{topic}', "MQTT Error on %s: %s", topic, e)
+    finally:
+        metrics.mqtt_handler.observe(time.perf_counter() - start, topic)
 
-def init_mqtt():
-    global client
+def init_mqtt(ingest=True, serve=True):
+    # ingest: subscribe to device topics and write them; serve: this process has SSE
+    # clients. Events cross processes over MQTT_EVENTS_TOPIC whenever the process that
+    # writes a sample isn't guaranteed to be the one serving its stream.
+    global client, client_id, ingesting, relay_in
     if not MQTT_BROKER:
         print("⚠️ MQTT not configured")
         return
     
+    ingesting = ingest
+    relay_in = serve and (bool(MQTT_SHARE_GROUP) or not ingest)
+    if ingest or serve:
+        # serve: acked control states are stored through the pipeline too
+        pipeline.start()
+    if serve:
+        dispatcher.start()
+    if relay_in or (ingest and (MQTT_SHARE_GROUP or not serve)):
+        # a web process relays too, so samples POSTed over HTTP reach its peers' streams
+        hub.relay = relay_event
     try:
-        client = mqtt.Client()
+        client_id = f"{MQTT_CLIENT_ID}-{'web' if serve else 'worker'}-{socket.gethostname()}-{os.getpid()}"
+        client = mqtt.Client(client_id=client_id, protocol=mqtt.MQTTv5)
         client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
-        client.tls_set(cert_reqs=ssl.CERT_NONE)
-        client.tls_insecure_set(True)
+        if MQTT_TLS:
+            client.tls_set(cert_reqs=ssl.CERT_NONE)
+            client.tls_insecure_set(True)
         client.on_connect = on_connect
         client.on_disconnect = on_disconnect
         client.on_message = on_message
@@ -68,17 +145,28 @@ def init_mqtt():
     except Exception as e:
         print(f"❌ MQTT Error: {e}")
 
-def publish_control(slot, command):
-    global client, mqtt_connected
+def stop_mqtt():
+    if client:
+        client.loop_stop()
+        client.disconnect()
+
+def send_control(e):
     if not client or not mqtt_connected:
         return False
     try:
-        payload = json.dumps({"slot": slot, "command": command})
-        client.publish("iot/control", payload)
-        print(f"📤 Control Slot {slot}: {command}")
+        payload = dumps({"slot": e['slot'], "command": e['command'], "seq": e['seq']})
+        if client.publish("iot/control", payload, qos=1).rc != mqtt.MQTT_ERR_SUCCESS:
+            return False
+        log.debug("📤 Control Slot %s: %s", e['slot'], e['command'])
         return True
-    except:
+    except Exception:
         return False
 
+def publish_control(commands):
+    # [(slot, command)] -> seq per command, or None when there is no broker to send to
+    if not dispatcher.running:
+        return None
+    return dispatcher.submit(commands)
+
 def get_mqtt_status():
     return {"connected": mqtt_connected, "broker": MQTT_BROKER}
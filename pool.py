@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+
+class PoolExhausted(Exception):
+    pass
+
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30, idle_timeout=300, ping_after=10, ping=None, reset=None):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.ping = ping
+        self.reset = reset
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, last_used)], most recently used at the end
+        self._size = 0
+        self._pid = os.getpid()
+        self._stats = {'checkouts': 0, 'created': 0, 'closed': 0, 'evicted': 0, 'failed_pings': 0,
+                       'waits': 0, 'wait_time': 0.0, 'max_wait': 0.0, 'exhausted': 0, 'timeouts': 0}
+
+    def _close(self, conn):
+        try: conn.close()
+        except: pass
+        self._stats['closed'] += 1
+
+    def _check_fork(self):
+        # gunicorn forks after import: never share sockets with the parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
+
+    def _evict_idle(self, now):
+        keep = []
+        excess = self._size - self.min_size
+        for conn, used in self._idle:
+            if excess > 0 and now - used > self.idle_timeout:
+                self._close(conn)
+                self._size -= 1
+                excess -= 1
+                self._stats['evicted'] += 1
+            else:
+                keep.append((conn, used))
+        self._idle = keep
+
+    def _healthy(self, conn, used):
+        if not self.ping or time.monotonic() - used < self.ping_after:
+            return True
+        try:
+            self.ping(conn)
+            return True
+        except Exception:
+            self._stats['failed_pings'] += 1
+            return False
+
+    def acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            self._check_fork()
+            while True:
+                self._evict_idle(time.monotonic())
+                if self._idle:
+                    conn, used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                if not waited:
+                    waited = True
+                    self._stats['exhausted'] += 1
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolExhausted(f"No DB connection available after {self.timeout}s (max {self.max_size})")
+                self._cond.wait(remaining)
+            self._stats['checkouts'] += 1
+            if waited:
+                w = time.monotonic() - start
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += w
+                self._stats['max_wait'] = max(self._stats['max_wait'], w)
+        if conn is not None:
+            if self._healthy(conn, used):
+                return conn
+            self._close(conn)
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self._stats['created'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard and self.reset:
+            try: self.reset(conn)
+            except Exception: discard = True
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            if discard:
+                self._close(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._cond:
+            s = dict(self._stats)
+            s.update({'size': self._size, 'idle': len(self._idle), 'in_use': self._size - len(self._idle),
+                      'min_size': self.min_size, 'max_size': self.max_size,
+                      'avg_wait': s['wait_time'] / s['waits'] if s['waits'] else 0.0})
+        return s
@@ -0,0 +1,136 @@
+import logging
+import math
+import threading
+import time
+import metrics
+from config import PRESENCE_TIMEOUT, PRESENCE_TICK, PRESENCE_WHEEL
+
+class PresenceTracker:
+    # Online/offline per slot from status messages, last wills and data heartbeats.
+    # Expiry runs on a hashed timer wheel: a heartbeat only updates last_seen, and a
+    # device is looked at again when its bucket comes round, at which point it is
+    # either timed out or rescheduled. Timeouts longer than the wheel just go round twice.
+    def __init__(self, timeout=120, tick=1.0, size=512, on_change=None):
+        self.timeout = timeout
+        self.tick = tick
+        self.size = size
+        self.on_change = on_change
+        self.version = 0
+        self._devices = {}
+        self._wheel = [set() for _ in range(size)]
+        self._ticks = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'heartbeats': 0, 'online': 0, 'offline': 0, 'timeouts': 0, 'wills': 0, 'rescheduled': 0}
+
+    def _schedule(self, slot, d, now):
+        ticks = math.ceil((d['last_seen'] + d['timeout'] - now) / self.tick)
+        d['bucket'] = (self._ticks + min(max(ticks, 1), self.size - 1)) % self.size
+        self._wheel[d['bucket']].add(slot)
+
+    def _set(self, d, online):
+        d['online'] = online
+        d['since'] = int(time.time() * 1000)
+        self.version += 1
+        self._stats['online' if online else 'offline'] += 1
+
+    def touch(self, slot, timeout=None):
+        now = time.monotonic()
+        with self._lock:
+            d = self._devices.get(slot)
+            if d is None:
+                d = self._devices[slot] = {'online': False, 'since': None, 'timeout': self.timeout, 'bucket': None}
+            d['last_seen'] = now
+            d['seen'] = int(time.time() * 1000)
+            if timeout: d['timeout'] = timeout
+            self._stats['heartbeats'] += 1
+            if d['bucket'] is None: self._schedule(slot, d, now)
+            changed = not d['online']
+            if changed: self._set(d, True)
+        if changed and self.on_change: self.on_change(slot, True)
+
+    def offline(self, slot):
+        # Explicit "offline" or the broker delivering a device's last will
+        with self._lock:
+            d = self._devices.get(slot)
+            if d is None or not d['online']:
+                return
+            self._set(d, False)
+            self._stats['wills'] += 1
+            if d['bucket'] is not None:
+                self._wheel[d['bucket']].discard(slot)
+                d['bucket'] = None
+        if self.on_change: self.on_change(slot, False)
+
+    def advance(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            self._ticks += 1
+            b = self._ticks % self.size
+            due, self._wheel[b] = self._wheel[b], set()
+            for slot in due:
+                d = self._devices.get(slot)
+                if d is None: continue
+                d['bucket'] = None
+                if now - d['last_seen'] >= d['timeout']:
+                    self._set(d, False)
+                    self._stats['timeouts'] += 1
+                    expired.append(slot)
+                else:
+                    self._stats['rescheduled'] += 1
+                    self._schedule(slot, d, now)
+        if self.on_change:
+            for slot in expired: self.on_change(slot, False)
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.advance()
+            except Exception as e:
+                metrics.sampled(logging.ERROR, 'presence', "Presence Error: %s", e)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='presence', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, slot):
+        d = self._devices.get(slot)
+        return {'online': d['online'], 'since': d['since']} if d else {'online': False, 'since': None}
+
+    def detail(self, slot):
+        d = self._devices.get(slot)
+        if d is None:
+            return {'online': False, 'since': None, 'last_seen': None, 'timeout': self.timeout}
+        return {'online': d['online'], 'since': d['since'], 'last_seen': d['seen'], 'timeout': d['timeout']}
+
+    def all(self):
+        with self._lock:
+            slots = list(self._devices)
+        return {n: self.detail(n) for n in slots}
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['devices'] = len(self._devices)
+            s['online_now'] = sum(1 for d in self._devices.values() if d['online'])
+            s['version'] = self.version
+        return s
+
+def _changed(slot, online):
+    from events import hub
+    hub.publish('presence', slot, online=online)
+
+presence = PresenceTracker(PRESENCE_TIMEOUT, PRESENCE_TICK, PRESENCE_WHEEL, _changed)
+
+def observe(evt):
+    # Hub listener: anything a slot produced counts as a heartbeat
+    if evt['type'] in ('data', 'camera') and evt.get('slot') is not None:
+        presence.touch(evt['slot'])
@@ -0,0 +1,169 @@
+import threading
+import time
+
+class VersionedCache:
+    # Process-local copy of a table. Writes made by other workers are picked up
+    # through a shared version counter polled at most every check_interval.
+    def __init__(self, get_version, check_interval=2.0):
+        self.get_version = get_version
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = 0.0
+        self._stats = {'hits': 0, 'misses': 0, 'reloads': 0, 'version_checks': 0}
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _reload(self):
+        version = self.get_version()
+        self._load()
+        self._version = version
+        self._stats['reloads'] += 1
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._version is not None and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if not force and self._version is not None and now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            if force or self._version is None:
+                self._reload()
+                return
+            self._stats['version_checks'] += 1
+            if self.get_version() != self._version:
+                self._reload()
+
+    def invalidate(self):
+        self.refresh(force=True)
+
+    def current(self):
+        self.refresh()
+        return self._version
+
+    def stats(self):
+        s = dict(self._stats)
+        s['version'] = self._version
+        return s
+
+TYPE_COUNTS = {'camera': 'total_cameras', 'control': 'total_controls', 'chart': 'total_charts'}
+
+class SlotRegistry(VersionedCache):
+    def __init__(self, load, get_version, check_interval=2.0):
+        super().__init__(get_version, check_interval)
+        self.load = load
+        self._slots = {}
+        self._view = ([], {})
+
+    def _load(self):
+        slots = self.load()
+        active = sorted((s for s in slots if s.get('is_active', 1)), key=lambda s: s['slot_number'])
+        counts = {'total_slots': len(active), 'total_cameras': 0, 'total_controls': 0, 'total_charts': 0}
+        for s in active:
+            key = TYPE_COUNTS.get(s.get('type'))
+            if key: counts[key] += 1
+        self._slots = {s['slot_number']: s for s in slots}
+        # active list and per-type counts are swapped together so readers never mix reloads
+        self._view = (active, counts)
+
+    def get(self, num):
+        self.refresh()
+        try:
+            s = self._slots.get(int(num))
+        except (TypeError, ValueError):
+            s = None
+        self._stats['hits' if s else 'misses'] += 1
+        return s
+
+    def all(self):
+        self.refresh()
+        return list(self._view[0])
+
+    def view(self):
+        self.refresh()
+        active, counts = self._view
+        return list(active), dict(counts)
+
+    def numbers(self):
+        self.refresh()
+        return set(self._slots)
+
+    def stats(self):
+        s = super().stats()
+        s['slots'] = len(self._slots)
+        return s
+
+class LastValueTable(VersionedCache):
+    # Latest sample per slot. Local writers apply their rows together with the
+    # version their transaction produced; any gap means another worker wrote
+    # in between, so the table is reloaded on the next read instead.
+    def __init__(self, load, get_version, check_interval=2.0):
+        super().__init__(get_version, check_interval)
+        self.load = load
+        self._values = {}
+
+    def _load(self):
+        self._values = {r['slot_number']: r for r in self.load()}
+
+    def apply(self, rows, version):
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._version = None
+                return
+            for r in rows:
+                cur = self._values.get(r['slot_number'])
+                if cur is None or r['ts'] >= cur['ts']:
+                    self._values[r['slot_number']] = r
+            self._version = version
+
+    def remove(self, num, version):
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                self._version = None
+                return
+            self._values.pop(num, None)
+            self._version = version
+
+    def peek(self, num):
+        return self._values.get(num) if self._version is not None else None
+
+    def get(self, num):
+        self.refresh()
+        r = self._values.get(num)
+        self._stats['hits' if r else 'misses'] += 1
+        return r
+
+    def all(self):
+        self.refresh()
+        self._stats['hits'] += 1
+        return dict(self._values)
+
+    def stats(self):
+        s = super().stats()
+        s['slots'] = len(self._values)
+        return s
+
+class RevocationList(VersionedCache):
+    # user_id -> epoch ms; tokens issued at or before it are rejected
+    def __init__(self, load, get_version, check_interval=2.0):
+        super().__init__(get_version, check_interval)
+        self.load = load
+        self._revoked = {}
+
+    def _load(self):
+        self._revoked = dict(self.load())
+
+    def revoked(self, user_id, issued_ms):
+        self.refresh()
+        at = self._revoked.get(user_id)
+        if at is None:
+            return False
+        self._stats['hits'] += 1
+        return issued_ms <= at
+
+    def stats(self):
+        s = super().stats()
+        s['users'] = len(self._revoked)
+        return s
@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response, Response
+from config import RESPONSE_CACHE, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_GZIP_MIN
+
+class ResponseCache:
+    # Serialized bodies keyed by endpoint, role and the versions they were built
+    # from. A key only ever maps to one body, so the ETag can be strong.
+    def __init__(self, size=256, gzip_min=1024):
+        self.size = size
+        self.gzip_min = gzip_min
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def put(self, key, body):
+        entry = {'body': body, 'etag': hashlib.sha256(body).hexdigest()[:32],
+                 'gzip': gzip.compress(body, 6) if len(body) >= self.gzip_min else None}
+        with self._lock:
+            self._items[key] = entry
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+                self._stats['evictions'] += 1
+        return entry
+
+    def not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['size'] = len(self._items)
+        return s
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_GZIP_MIN)
+
+def _serve(entry):
+    gz = entry['gzip'] is not None and request.accept_encodings['gzip'] > 0
+    etag = entry['etag'] + ('-gz' if gz else '')
+    if request.if_none_match.contains(etag):
+        response_cache.not_modified()
+        resp = Response(status=304)
+    else:
+        resp = Response(entry['gzip'] if gz else entry['body'], mimetype='application/json')
+        if gz: resp.headers['Content-Encoding'] = 'gzip'
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    resp.headers['Vary'] = 'Authorization, Accept-Encoding'
+    return resp
+
+def cached(*versions):
+    # Goes under require_auth; each entry of versions is a zero-arg callable
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not RESPONSE_CACHE:
+                return f(*args, **kwargs)
+            key = (request.endpoint, request.user.get('role'), tuple(sorted(kwargs.items())), tuple(v() for v in versions))
+            entry = response_cache.get(key)
+            if entry is None:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                entry = response_cache.put(key, resp.get_data())
+            return _serve(entry)
+        return decorated
+    return decorator
@@ -0,0 +1,30 @@
+import threading
+import time
+from config import COMPACT_INTERVAL
+
+_thread = None
+stats = {'runs': 0, 'errors': 0, 'expired': 0, 'partitions_dropped': 0, 'watermark': 0, 'last_run': None, 'last_duration': 0.0}
+
+def _run():
+    from models import compact_slot_data
+    while True:
+        start = time.time()
+        try:
+            r = compact_slot_data()
+            stats['expired'] += r['expired']
+            stats['partitions_dropped'] += r['partitions_dropped']
+            stats['watermark'] = r['watermark']
+        except Exception as e:
+            stats['errors'] += 1
+            print(f"Compaction Error: {e}")
+        stats['runs'] += 1
+        stats['last_run'] = start
+        stats['last_duration'] = time.time() - start
+        time.sleep(COMPACT_INTERVAL)
+
+def start_compaction():
+    global _thread
+    if COMPACT_INTERVAL <= 0 or (_thread and _thread.is_alive()):
+        return
+    _thread = threading.Thread(target=_run, name='compaction', daemon=True)
+    _thread.start()
@@ -0,0 +1,41 @@
+import json
+from flask.json.provider import DefaultJSONProvider, _default
+from config import JSON_BACKEND
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson when available (JSON_BACKEND=json forces the stdlib). Both take bytes
+# straight off the wire and produce bytes; output matches Flask's defaults: sorted
+# keys, int dict keys as strings, dates as HTTP dates.
+if orjson is not None and JSON_BACKEND != 'json':
+    BACKEND = 'orjson'
+    _OPTS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=_OPTS)
+else:
+    BACKEND = 'json'
+
+    def loads(data):
+        return json.loads(data)
+
+    def dumps(obj):
+        return json.dumps(obj, default=_default, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+class FastJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # bytes go into the response as-is, no str round trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
@@ -0,0 +1,176 @@
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from serializer import loads, dumps
+
+HEADER = struct.Struct('<I')
+
+class SegmentSpool:
+    # Append-only log of sample batches in preallocated, memory-mapped segment files.
+    # Each record is <len u32><json [[slot, value, ts], ...]>; the payload is written
+    # before its length, so a record cut short by a crash reads as the zero-filled end.
+    # A cursor file remembers how far replay got; fully replayed segments are deleted.
+    def __init__(self, root, segment_bytes=16 << 20, max_bytes=512 << 20):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.max_segments = max(max_bytes // segment_bytes, 2)
+        self._lock = threading.Lock()
+        self._stats = {'records': 0, 'spooled': 0, 'replayed': 0, 'dropped': 0, 'rotations': 0}
+        os.makedirs(root, exist_ok=True)
+        self._segments = sorted(int(n[4:-4]) for n in os.listdir(root) if n.startswith('seg-') and n.endswith('.log'))
+        self._cursor = self._load_cursor()
+        self._file = self._mm = None
+        self._sealed = None  # (segment, mmap, end) being replayed
+        self._open_writer(self._segments[-1] if self._segments else 0)
+
+    @classmethod
+    def claim(cls, root, **kw):
+        # One spool per process; a restarted process takes over (and drains) a free slot
+        os.makedirs(root, exist_ok=True)
+        for k in range(256):
+            path = os.path.join(root, str(k))
+            os.makedirs(path, exist_ok=True)
+            fd = os.open(os.path.join(path, 'lock'), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            spool = cls(path, **kw)
+            spool._lock_fd = fd
+            return spool
+        raise RuntimeError(f"no free spool slot under {root}")
+
+    def _path(self, n):
+        return os.path.join(self.root, f'seg-{n:08d}.log')
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.root, 'cursor')) as f:
+                seg, off = f.read().split()
+                return int(seg), int(off)
+        except (OSError, ValueError):
+            return (self._segments[0] if self._segments else 0), 0
+
+    def _save_cursor(self, cursor):
+        tmp = os.path.join(self.root, 'cursor.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f"{cursor[0]} {cursor[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.root, 'cursor'))
+
+    def _end(self, mm, limit):
+        pos = 0
+        while pos + HEADER.size <= limit:
+            n = HEADER.unpack_from(mm, pos)[0]
+            if n == 0 or pos + HEADER.size + n > limit:
+                break
+            pos += HEADER.size + n
+        return pos
+
+    def _open_writer(self, n):
+        self._file = open(self._path(n), 'a+b')
+        if os.fstat(self._file.fileno()).st_size < self.segment_bytes:
+            self._file.truncate(self.segment_bytes)
+        self._mm = mmap.mmap(self._file.fileno(), self.segment_bytes)
+        self._wseg = n
+        self._wpos = self._end(self._mm, self.segment_bytes)
+        if n not in self._segments:
+            self._segments.append(n)
+
+    def _rotate(self):
+        self._mm.flush()
+        self._mm.close()
+        self._file.close()
+        self._stats['rotations'] += 1
+        self._open_writer(self._wseg + 1)
+
+    def append(self, samples):
+        payload = dumps([list(s) for s in samples])
+        need = HEADER.size + len(payload)
+        if need > self.segment_bytes:
+            mid = len(samples) // 2
+            return mid > 0 and self.append(samples[:mid]) & self.append(samples[mid:])
+        with self._lock:
+            if self._wpos + need > self.segment_bytes:
+                if len(self._segments) >= self.max_segments:
+                    self._stats['dropped'] += len(samples)
+                    return False
+                self._rotate()
+            pos = self._wpos
+            self._mm[pos + HEADER.size:pos + need] = payload
+            HEADER.pack_into(self._mm, pos, len(payload))
+            self._wpos = pos + need
+            self._stats['records'] += 1
+            self._stats['spooled'] += len(samples)
+        return True
+
+    def read(self, max_samples):
+        # -> (samples, cursor to commit once they are stored)
+        samples = []
+        with self._lock:
+            seg, off = self._cursor
+            while len(samples) < max_samples:
+                if seg not in self._segments:
+                    later = [n for n in self._segments if n > seg]
+                    if not later: break
+                    seg, off = later[0], 0
+                if seg == self._wseg:
+                    mm, limit, sealed = self._mm, self._wpos, False
+                else:
+                    mm, limit = self._map_sealed(seg)
+                    sealed = True
+                while off < limit and len(samples) < max_samples:
+                    n = HEADER.unpack_from(mm, off)[0]
+                    samples.extend(tuple(s) for s in loads(bytes(mm[off + HEADER.size:off + HEADER.size + n])))
+                    off += HEADER.size + n
+                if off < limit or not sealed:
+                    break
+                seg, off = seg + 1, 0
+        return samples, (seg, off)
+
+    def _map_sealed(self, seg):
+        if self._sealed is None or self._sealed[0] != seg:
+            self._unmap_sealed()
+            with open(self._path(seg), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._sealed = (seg, mm, self._end(mm, len(mm)))
+        return self._sealed[1], self._sealed[2]
+
+    def _unmap_sealed(self):
+        if self._sealed:
+            self._sealed[1].close()
+            self._sealed = None
+
+    def commit(self, cursor, replayed):
+        with self._lock:
+            self._cursor = cursor
+            self._save_cursor(cursor)
+            for n in [n for n in self._segments if n < cursor[0] and n != self._wseg]:
+                if self._sealed and self._sealed[0] == n:
+                    self._unmap_sealed()
+                os.remove(self._path(n))
+                self._segments.remove(n)
+            self._stats['replayed'] += replayed
+
+    def pending(self):
+        with self._lock:
+            seg, off = self._cursor
+            return seg != self._wseg or off < self._wpos
+
+    def close(self):
+        with self._lock:
+            self._unmap_sealed()
+            if self._mm:
+                self._mm.flush()
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s['segments'] = len(self._segments)
+            s['disk_bytes'] = len(self._segments) * self.segment_bytes
+        s['pending'] = self.pending()
+        return s
@@ -0,0 +1,147 @@
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    from gevent import monkey
+    _thread_id = monkey.get_original('_thread', 'get_ident')
+except ImportError:
+    _thread_id = threading.get_ident
+
+class SQLiteEngine:
+    # WAL-mode SQLite for one process. Every OS thread keeps a long-lived read-only
+    # connection (greenlets share their thread's: sqlite calls never yield), and all
+    # writes go through one connection: single statements and insert batches are queued
+    # to a writer thread that commits whatever piled up during the previous commit as
+    # one transaction, each job inside its own savepoint so a failing job fails alone.
+    def __init__(self, path, synchronous='NORMAL', cache_mb=64, mmap_mb=256, busy_timeout=5000,
+                 statement_cache=256, group_max=256):
+        self.path = path
+        self.pragmas = [f"synchronous = {synchronous}", f"cache_size = {-cache_mb * 1024}",
+                        f"mmap_size = {mmap_mb << 20}", f"busy_timeout = {busy_timeout}", "temp_store = MEMORY"]
+        self.statement_cache = statement_cache
+        self.group_max = group_max
+        self._pid = None
+        self._init_lock = threading.Lock()
+        self._stats = {'jobs': 0, 'groups': 0, 'max_group': 0, 'failed': 0, 'commit_time': 0.0, 'exclusive': 0}
+
+    def _check_fork(self):
+        # started lazily so gunicorn workers each get their own writer after forking
+        if self._pid == os.getpid():
+            return
+        with self._init_lock:
+            if self._pid == os.getpid():
+                return
+            self._readers = {}
+            self._queue = queue.Queue()
+            self._wlock = threading.Lock()
+            self._local = threading.local()
+            self._writer = self.connect()
+            self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def connect(self, readonly=False):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                               cached_statements=self.statement_cache)
+        conn.row_factory = sqlite3.Row
+        if not readonly:
+            conn.execute("PRAGMA journal_mode = WAL")
+        for p in self.pragmas + (["query_only = 1"] if readonly else []):
+            conn.execute(f"PRAGMA {p}")
+        return conn
+
+    def reader(self):
+        self._check_fork()
+        ident = _thread_id()
+        conn = self._readers.get(ident)
+        if conn is None:
+            alive = sys._current_frames()
+            for t in [t for t in self._readers if t not in alive]:
+                self._readers.pop(t).close()
+            conn = self._readers[ident] = self.connect(readonly=True)
+        return conn
+
+    def write(self, fn):
+        # fn(cursor) runs on the writer connection; returns its result once committed
+        self._check_fork()
+        cur = getattr(self._local, 'cur', None)
+        if cur is not None:
+            # already inside transaction() on this thread: join it
+            return fn(cur)
+        fut = Future()
+        self._queue.put((fn, fut))
+        return fut.result()
+
+    @contextmanager
+    def transaction(self):
+        # multi-statement transactions run on the caller's thread, holding the writer
+        self._check_fork()
+        with self._wlock:
+            cur = self._writer.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            self._local.cur = cur
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except Exception:
+                self._writer.rollback()
+                raise
+            finally:
+                self._local.cur = None
+                cur.close()
+                self._stats['exclusive'] += 1
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.group_max:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            start = time.perf_counter()
+            with self._wlock:
+                cur = self._local.cur = self._writer.cursor()
+                try:
+                    cur.execute("BEGIN IMMEDIATE")
+                    for fn, fut in jobs:
+                        cur.execute("SAVEPOINT job")
+                        try:
+                            results.append((fut, fn(cur), None))
+                            cur.execute("RELEASE job")
+                        except Exception as e:
+                            cur.execute("ROLLBACK TO job")
+                            cur.execute("RELEASE job")
+                            results.append((fut, None, e))
+                    cur.execute("COMMIT")
+                except Exception as e:
+                    self._writer.rollback()
+                    results = [(fut, None, e) for _, fut in jobs]
+                finally:
+                    self._local.cur = None
+                    cur.close()
+            s = self._stats
+            s['jobs'] += len(jobs)
+            s['groups'] += 1
+            s['max_group'] = max(s['max_group'], len(jobs))
+            s['commit_time'] += time.perf_counter() - start
+            for fut, result, err in results:
+                if err is None:
+                    fut.set_result(result)
+                else:
+                    s['failed'] += 1
+                    fut.set_exception(err)
+
+    def stats(self):
+        s = dict(self._stats)
+        s['readers'] = len(self._readers) if self._pid else 0
+        s['queued'] = self._queue.qsize() if self._pid else 0
+        s['avg_group'] = s['jobs'] / s['groups'] if s['groups'] else 0.0
+        return s
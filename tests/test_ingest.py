@@ -0,0 +1,109 @@
+import time
+import pytest
+from ingest import IngestPipeline
+
+MAX_TS = 2 ** 63
+
+class FakeDB:
+    # stands in for save_slot_data_batch: refuses the whole batch when down or when any
+    # row has a ts the DB can't store, like an int64 column would
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    def write(self, batch):
+        if self.down:
+            raise ConnectionError("database is down")
+        if any(ts >= MAX_TS - 2 for _, _, ts in batch):
+            raise OverflowError("Python int too large to convert to SQLite INTEGER")
+        self.rows.extend(batch)
+        return len(batch)
+
+def wait_for(cond, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+@pytest.fixture
+def make(db, tmp_path):
+    made = []
+    def make(**kw):
+        p = IngestPipeline(db.write, batch_size=100, flush_interval=0.01, retry_interval=0.01,
+                           spool_dir=str(tmp_path / 'spool'), spool_opts={'segment_bytes': 1 << 16}, **kw)
+        made.append(p)
+        return p
+    yield make
+    for p in made:
+        p.stop()
+
+def good(n, ts=1700000000000):
+    return [(1, i, ts + i) for i in range(n)]
+
+def test_bad_row_is_discarded_not_the_batch(db, make):
+    p = make()
+    batch = good(5) + [(1, 0, int(1e20))]
+    p._flush(batch, 'size_flushes')
+    assert sorted(db.rows) == sorted(good(5))
+    s = p.stats()
+    assert (s['written'], s['discarded'], s['spooled'], s['failed']) == (5, 1, 0, 0)
+
+def test_unencodable_sample_does_not_stop_the_ingest_thread(db, make):
+    p = make()
+    p.start()
+    db.down = True
+    for s in good(3) + [(1, 0, int(1e20))]:
+        p.submit(*s)
+    wait_for(lambda: p.stats()['spooled'] + p.stats()['failed'] == 4)
+    db.down = False
+    for s in good(2, ts=1800000000000):
+        p.submit(*s)
+    wait_for(lambda: len(db.rows) == 5)
+    assert p._thread.is_alive()
+
+def test_replay_skips_rows_the_db_refuses(db, make):
+    p = make()
+    p.start()
+    db.down = True
+    p._flush(good(5) + [(1, 0, int(1e20))], 'size_flushes')
+    assert p.spool.pending()
+    db.down = False
+    wait_for(lambda: not p.spool.pending())
+    assert sorted(db.rows) == sorted(good(5))
+    # orjson can't even spool the bad row; the stdlib encoder spools it and replay drops it
+    s = p.stats()
+    assert s['discarded'] + s['failed'] == 1
+
+def test_replay_gives_up_on_refused_rows_while_the_db_is_up(db, make):
+    p = make(max_replays=2)
+    bad = [(1, 0, MAX_TS - 2), (1, 1, MAX_TS - 1)]
+    p.start()
+    db.down = True
+    p._flush(bad + good(3), 'size_flushes')
+    db.down = False
+    # two refused rows up front look like an outage until live writes show the DB is up
+    for i in range(50):
+        p.submit(2, i, 1900000000000 + i)
+        time.sleep(0.01)
+        if not p.spool.pending():
+            break
+    wait_for(lambda: not p.spool.pending())
+    assert set(good(3)) <= set(db.rows)
+    assert p.stats()['discarded'] == 2
+
+def test_outage_keeps_everything_spooled(db, make):
+    p = make(max_replays=1)
+    db.down = True
+    p.start()
+    for s in good(20):
+        p.submit(*s)
+    wait_for(lambda: p.stats()['spooled'] == 20)
+    time.sleep(0.2)
+    assert p.stats()['discarded'] == 0
+    db.down = False
+    wait_for(lambda: not p.spool.pending())
+    assert sorted(db.rows) == sorted(good(20))
@@ -0,0 +1,71 @@
+import datetime
+import math
+
+def parse_time(s, default=None):
+    # Epoch seconds or ISO 8601; naive values are taken as UTC like the DB timestamps
+    if s is None or s == '':
+        return default
+    try:
+        t = float(s)
+    except ValueError:
+        pass
+    else:
+        try:
+            return datetime.datetime.utcfromtimestamp(t)
+        except (OverflowError, OSError):
+            raise ValueError(f"time out of range: {s}")
+    dt = datetime.datetime.fromisoformat(s.replace('Z', '+00:00'))
+    if dt.tzinfo:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt
+
+def epoch(dt):
+    return int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def device_ts(ts, horizon):
+    # Device clocks report epoch seconds or ms; None when the device sent none (use arrival
+    # time). A ts that is there but unusable, or past horizon (ms), is an error, not "now".
+    if ts is None:
+        return None
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)) or not 0 < ts < 2 ** 63:
+        raise ValueError("ts không hợp lệ")
+    ms = int(ts * 1000) if ts < 1e11 else int(ts)
+    if ms > horizon:
+        raise ValueError("ts ở tương lai")
+    return ms
+
+def bucket_width(start, end, width=None, max_buckets=1000):
+    # Widen the requested bucket so a range never yields more than max_buckets rows
+    span = max(epoch(end) - epoch(start), 1)
+    w = max(int(width or 0), math.ceil(span / max_buckets), 1)
+    # past a minute, round up to whole rollup buckets (1m/1h/1d) so the rollup tiers can serve it
+    for g in (86400, 3600, 60):
+        if w > g:
+            return -(-w // g) * g
+    return w
+
+def lttb(points, threshold):
+    # Largest-Triangle-Three-Buckets over [(t, v)] sorted by t
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+    out = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        lo = int(math.floor((i + 1) * every)) + 1
+        hi = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_t = sum(p[0] for p in points[lo:hi]) / (hi - lo)
+        avg_v = sum(p[1] for p in points[lo:hi]) / (hi - lo)
+        start = int(math.floor(i * every)) + 1
+        end = lo
+        at, av = points[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((at - avg_t) * (points[j][1] - av) - (at - points[j][0]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[-1])
+    return out
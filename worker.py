@@ -0,0 +1,27 @@
+# Ingestion worker: consumes device topics and writes them, with no HTTP serving.
+# Run any number of these (each gets its own client id; MQTT_SHARE_GROUP spreads
+# messages across them) and set MQTT_INGEST=0 on the web processes.
+import signal
+import threading
+from models import init_db
+from mqtt_handler import init_mqtt, stop_mqtt
+from ingest import pipeline
+from config import MQTT_BROKER
+
+def main():
+    if not MQTT_BROKER:
+        print("❌ MQTT_BROKER not set")
+        return
+    init_db()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *a: stop.set())
+    signal.signal(signal.SIGINT, lambda *a: stop.set())
+    init_mqtt(ingest=True, serve=False)
+    print("👷 Ingestion worker running")
+    stop.wait()
+    stop_mqtt()
+    pipeline.stop()
+    print("👋 Ingestion worker stopped")
+
+if __name__ == '__main__':
+    main()